@@ -0,0 +1,95 @@
+import glob
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+
+from flask import request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+DIST_FOLDER = os.path.join(STATIC_FOLDER, 'dist')
+MANIFEST_PATH = os.path.join(DIST_FOLDER, 'manifest.json')
+# site assets only; user uploads under static/images are content-addressed already
+ASSET_PATTERNS = ('style/*.css', 'js/*.js', 'images/ask.png')
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg')
+CACHE_MAX_AGE = 31536000
+CACHE_CONTROL = f'public, max-age={CACHE_MAX_AGE}, immutable'
+# precompressed variants in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_manifest = None
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as file:
+        file.write(content)
+
+
+def build():
+    manifest = {}
+    for pattern in ASSET_PATTERNS:
+        for source in sorted(glob.glob(os.path.join(STATIC_FOLDER, pattern))):
+            with open(source, 'rb') as file:
+                content = file.read()
+            name = os.path.relpath(source, STATIC_FOLDER).replace(os.sep, '/')
+            stem, extension = os.path.splitext(name)
+            fingerprinted = f'{stem}.{hashlib.sha256(content).hexdigest()[:12]}{extension}'
+            target = os.path.join(DIST_FOLDER, fingerprinted)
+            _write(target, content)
+            if extension in COMPRESSIBLE_EXTENSIONS:
+                # mtime=0 keeps the .gz byte-identical between builds of the same file
+                _write(f'{target}.gz', gzip.compress(content, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    _write(f'{target}.br', brotli.compress(content))
+            manifest[name] = fingerprinted
+    _write(MANIFEST_PATH, json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def load_manifest():
+    global _manifest
+    try:
+        with open(MANIFEST_PATH) as file:
+            _manifest = json.load(file)
+    except FileNotFoundError:
+        # not built (e.g. in development) - assets are served from static/ as before
+        _manifest = {}
+    return _manifest
+
+
+def resolve(filename):
+    manifest = _manifest if _manifest is not None else load_manifest()
+    fingerprinted = manifest.get(filename)
+    if fingerprinted is None:
+        return 'static', filename
+    return 'serve_asset', fingerprinted
+
+
+def asset_url(filename):
+    endpoint, filename = resolve(filename)
+    return url_for(endpoint, filename=filename)
+
+
+def choose_encoding(filename, accept_encodings):
+    for encoding, suffix in ENCODINGS:
+        if encoding in accept_encodings and os.path.isfile(os.path.join(DIST_FOLDER, filename + suffix)):
+            return encoding, filename + suffix
+    return None, filename
+
+
+def send_asset(filename):
+    encoding, path = choose_encoding(filename, request.accept_encodings)
+    response = send_from_directory(DIST_FOLDER, path, mimetype=mimetypes.guess_type(filename)[0],
+                                   max_age=CACHE_MAX_AGE)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
+    return response
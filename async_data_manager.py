@@ -0,0 +1,271 @@
+import asyncio
+
+import async_database_common as db
+import cache
+import counter_buffer
+import data_manager as dm
+
+# The SQL, its parameters and the cache invalidation all come from data_manager; this module only runs them
+# on asyncpg. Statements here run outside an explicit transaction, so a write is committed by the time
+# the invalidation helpers are called.
+
+# the serving event loop; the counter buffers flush from their own thread and hand their statements to it
+_loop = None
+
+
+def start(loop):
+    global _loop
+    _loop = loop
+
+
+async def stop():
+    # the last flush runs its statements on the loop, so the loop must stay free while the flusher waits
+    await asyncio.to_thread(vote_counters.stop)
+    await asyncio.to_thread(view_counter.stop)
+
+
+def _run_on_loop(coroutine):
+    if _loop is None:
+        coroutine.close()
+        raise RuntimeError('async_data_manager.start() was not called')
+    return asyncio.run_coroutine_threadsafe(coroutine, _loop).result()
+
+
+@cache.cached('latest_questions', dm.LATEST_QUESTIONS_TTL)
+@db.connection_handler
+async def get_latest_questions(connection, number, listing_version=None):
+    return await db.fetch(connection, dm.LATEST_QUESTIONS_QUERY, {'number': number})
+
+
+@db.connection_handler
+async def get_listing_version(connection):
+    return await db.fetchrow(connection, dm.LISTING_VERSION_QUERY)
+
+
+@db.connection_handler
+async def get_question_version(connection, question_id):
+    return await db.fetchrow(connection, dm.QUESTION_VERSION_QUERY, {'question_id': int(question_id)})
+
+
+@cache.cached('questions_page', dm.QUESTIONS_PAGE_TTL)
+@db.connection_handler
+async def get_questions_page(connection, order_by, order_direction, page_cursor=None,
+                             per_page=dm.QUESTIONS_PER_PAGE, tag_id=None, listing_version=None):
+    # listing_version only keys the cache, see data_manager.get_questions_page
+    _, query, params, backwards = dm.questions_page_query(order_by, order_direction, page_cursor, per_page, tag_id)
+    questions = await db.fetch(connection, query, params)
+    return dm.questions_page(questions, order_by, page_cursor, per_page, backwards)
+
+
+@cache.cached('question_page', dm.QUESTION_PAGE_TTL)
+@db.connection_handler
+async def load_question_page(connection, question_id):
+    question = await db.fetchrow(connection, dm.QUESTION_PAGE_QUERY, {'question_id': int(question_id)})
+    return dm.question_page(question)
+
+
+async def load_question_page_at(question_id, revision):
+    # see data_manager.load_question_page_at
+    page = await load_question_page(question_id)
+    if page is not None and page['question']['revision'] < revision:
+        cache.invalidate('question_page', int(question_id))
+        page = await load_question_page(question_id)
+    return page
+
+
+@db.connection_handler
+async def get_question_by_id(connection, question_id):
+    return await db.fetchrow(connection, dm.QUESTION_BY_ID_QUERY, {'question_id': int(question_id)})
+
+
+@db.connection_handler
+async def get_answer_by_id(connection, answer_id):
+    return await db.fetchrow(connection, dm.ANSWER_BY_ID_QUERY, {'answer_id': int(answer_id)})
+
+
+@db.connection_handler
+async def get_comment_by_id(connection, comment_id):
+    return await db.fetchrow(connection, dm.COMMENT_BY_ID_QUERY, {'comment_id': int(comment_id)})
+
+
+@db.connection_handler
+async def get_question_id_by_answer_id(connection, answer_id):
+    return await db.fetchval(connection, dm.QUESTION_ID_BY_ANSWER_QUERY, {'answer_id': int(answer_id)})
+
+
+@db.connection_handler
+async def get_image_link_by_question_id(connection, question_id):
+    return await db.fetchrow(connection, dm.IMAGE_BY_QUESTION_QUERY, {'question_id': int(question_id)})
+
+
+@db.connection_handler
+async def search_results(connection, search_phrase, page=1, per_page=dm.SEARCH_RESULTS_PER_PAGE):
+    results = await db.fetch(connection, dm.SEARCH_QUERY, dm.search_params(search_phrase, page, per_page))
+    return dm.search_page(results, page, per_page)
+
+
+@db.connection_handler
+async def get_existing_tags(connection):
+    return await db.fetch(connection, dm.TAGS_QUERY)
+
+
+@db.connection_handler
+async def get_tag_id(connection, tag_name):
+    return await db.fetchval(connection, dm.TAG_ID_QUERY, {'name': tag_name})
+
+
+@cache.cached('tag_cloud', dm.TAG_CLOUD_TTL)
+@db.connection_handler
+async def get_tag_cloud(connection, size=dm.TAG_CLOUD_SIZE):
+    return await db.fetch(connection, dm.TAG_CLOUD_QUERY, {'size': size})
+
+
+@db.connection_handler
+async def add_question(connection, title, message, image=None):
+    question_id = await db.fetchval(connection, dm.ADD_QUESTION_QUERY,
+                                    {'title': title, 'message': message, 'image': image})
+    dm.invalidate_listings()
+    return question_id
+
+
+@db.connection_handler
+async def add_answer(connection, question_id, message):
+    answer_id = await db.fetchval(connection, dm.ADD_ANSWER_QUERY,
+                                  {'question_id': int(question_id), 'message': message})
+    dm.invalidate_question(question_id, listings=True)
+    return answer_id
+
+
+@db.connection_handler
+async def edit_question(connection, question_id, title, message):
+    await db.execute(connection, dm.EDIT_QUESTION_QUERY,
+                     {'title': title, 'message': message, 'question_id': int(question_id)})
+    dm.invalidate_question(question_id, listings=True)
+
+
+@db.connection_handler
+async def edit_answer(connection, answer_id, message):
+    question_id = await db.fetchval(connection, dm.EDIT_ANSWER_QUERY, {'message': message, 'answer_id': int(answer_id)})
+    return dm.answer_edited(answer_id, question_id)
+
+
+@db.connection_handler
+async def add_comment_to_question(connection, question_id, message):
+    await db.execute(connection, dm.ADD_QUESTION_COMMENT_QUERY, {'question_id': int(question_id), 'message': message})
+    dm.invalidate_question(question_id, listings=True)
+    return question_id
+
+
+@db.connection_handler
+async def add_comment_to_answer(connection, answer_id, message):
+    question_id = await db.fetchval(connection, dm.ADD_ANSWER_COMMENT_QUERY,
+                                    {'answer_id': int(answer_id), 'message': message})
+    return dm.answer_commented(answer_id, question_id)
+
+
+@db.connection_handler
+async def edit_comment(connection, comment_id, message):
+    comment = await db.fetchrow(connection, dm.EDIT_COMMENT_QUERY, {'message': message, 'comment_id': int(comment_id)})
+    return dm.comment_edited(comment)
+
+
+@db.connection_handler
+async def delete_question(connection, question_id):
+    dm.questions_deleted(await db.fetch(connection, *dm.delete_questions_query([question_id])))
+
+
+@db.connection_handler
+async def delete_answer(connection, answer_id):
+    deleted = dm.answers_deleted(await db.fetch(connection, *dm.delete_answers_query([answer_id])))
+    return deleted[0]['question_id'] if deleted else None
+
+
+@db.connection_handler
+async def delete_comment(connection, comment_id):
+    deleted = dm.comments_deleted(await db.fetch(connection, *dm.delete_comments_query([comment_id])))
+    return deleted[0]['question_id'] if deleted else None
+
+
+@db.connection_handler
+async def cast_vote(connection, table, item_id, user_id, value, apply_counter=True):
+    params = dm.cast_vote_params(table, item_id, user_id, value, apply_counter)
+    result = await db.fetchrow(connection, dm.CAST_VOTE_QUERIES[table], params)
+    return dm.vote_cast(table, item_id, result, apply_counter)
+
+
+@db.connection_handler
+async def _flush_vote_counters(connection, increments):
+    updated = await db.fetch(connection, dm.FLUSH_VOTE_COUNTERS_QUERY, dm.vote_counters_params(increments))
+    dm.vote_counters_flushed(updated)
+
+
+def flush_vote_counters(increments):
+    _run_on_loop(_flush_vote_counters(increments))
+
+
+vote_counters = counter_buffer.CounterBuffer(flush_vote_counters, dm.VOTE_FLUSH_INTERVAL, dm.VOTE_FLUSH_THRESHOLD)
+
+
+async def vote(table, item_id, user_id, vote_type):
+    # hotness is per item, not per data layer, so the rate tracker is shared with data_manager
+    hot = dm.hot_votes.hit((table, int(item_id)))
+    delta = await cast_vote(table, item_id, user_id, dm.VOTE_VALUES[vote_type], apply_counter=not hot)
+    if hot and delta:
+        vote_counters.add((table, int(item_id)), delta)
+    return delta
+
+
+@db.connection_handler
+async def _flush_question_views(connection, increments):
+    await db.execute(connection, dm.FLUSH_QUESTION_VIEWS_QUERY, dm.question_views_params(increments))
+
+
+def flush_question_views(increments):
+    _run_on_loop(_flush_question_views(increments))
+
+
+view_counter = counter_buffer.CounterBuffer(flush_question_views, dm.VIEW_FLUSH_INTERVAL, dm.VIEW_FLUSH_THRESHOLD)
+
+
+def update_question_views(question_id):
+    # only an in-memory increment; the buffered flush happens on the buffer's own thread
+    view_counter.add(int(question_id))
+
+
+@db.connection_handler
+async def add_new_tags(connection, tag_names):
+    tag_names = list(dict.fromkeys(name.strip() for name in tag_names if name.strip()))
+    if not tag_names:
+        return []
+    tag_ids = dm.tags_upserted(await db.fetch(connection, dm.UPSERT_TAGS_QUERY, {'names': tag_names}))
+    return [tag_ids[name] for name in tag_names]
+
+
+@db.connection_handler
+async def add_tags(connection, question_id, tag_ids):
+    tag_ids = sorted({int(tag_id) for tag_id in tag_ids})
+    if not tag_ids:
+        return
+    await db.execute(connection, dm.ADD_TAGS_QUERY, {'question_id': int(question_id), 'tag_ids': tag_ids})
+    dm.invalidate_tagging(question_id)
+
+
+@db.connection_handler
+async def delete_tag_from_question(connection, question_id, tag_id):
+    await db.execute(connection, dm.DELETE_QUESTION_TAG_QUERY, {'question_id': int(question_id), 'tag_id': int(tag_id)})
+    dm.invalidate_tagging(question_id)
+
+
+@db.connection_handler
+async def register_user(connection, email, password_hash):
+    return await db.fetchval(connection, dm.REGISTER_USER_QUERY, {'email': email, 'password': password_hash})
+
+
+@db.connection_handler
+async def get_user_credentials(connection, email):
+    return await db.fetchrow(connection, dm.USER_CREDENTIALS_QUERY, {'email': email})
+
+
+@db.connection_handler
+async def update_password_hash(connection, user_id, password_hash):
+    await db.execute(connection, dm.UPDATE_PASSWORD_HASH_QUERY, {'password': password_hash, 'user_id': int(user_id)})
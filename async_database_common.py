@@ -0,0 +1,85 @@
+import functools
+import json
+
+import asyncpg
+
+import database_common
+
+_pool = None
+
+
+async def _init_connection(connection):
+    # same shape as psycopg2 gives the sync data layer: jsonb columns arrive as Python objects
+    await connection.set_type_codec('jsonb', encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+
+async def get_pool():
+    global _pool
+    if _pool is None:
+        try:
+            _pool = await asyncpg.create_pool(database_common.get_connection_string(),
+                                              min_size=database_common.POOL_MIN_SIZE,
+                                              max_size=database_common.POOL_MAX_SIZE,
+                                              init=_init_connection)
+        except (OSError, asyncpg.PostgresError) as exception:
+            print('Database connection problem')
+            raise exception
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def pool_stats():
+    if _pool is None:
+        return {'size': 0, 'idle': 0}
+    return {'size': _pool.get_size(), 'idle': _pool.get_idle_size(),
+            'min_size': _pool.get_min_size(), 'max_size': _pool.get_max_size()}
+
+
+def connection_handler(function):
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        pool = await get_pool()
+        async with pool.acquire() as connection:
+            return await function(connection, *args, **kwargs)
+
+    return wrapper
+
+
+def _statement(query, params):
+    # the data layers share their SQL, written with psycopg2 placeholders; asyncpg wants $1, $2, ...
+    text, keys = database_common.number_placeholders(query)
+    return text, [params[key] for key in keys]
+
+
+async def fetch(connection, query, params=None):
+    text, arguments = _statement(query, params)
+    return to_dicts(await connection.fetch(text, *arguments))
+
+
+async def fetchrow(connection, query, params=None):
+    text, arguments = _statement(query, params)
+    return to_dict(await connection.fetchrow(text, *arguments))
+
+
+async def fetchval(connection, query, params=None):
+    text, arguments = _statement(query, params)
+    return await connection.fetchval(text, *arguments)
+
+
+async def execute(connection, query, params=None):
+    text, arguments = _statement(query, params)
+    return await connection.execute(text, *arguments)
+
+
+def to_dict(record):
+    return dict(record) if record is not None else None
+
+
+def to_dicts(records):
+    return [dict(record) for record in records]
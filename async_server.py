@@ -0,0 +1,391 @@
+import asyncio
+import mimetypes
+
+from markupsafe import Markup
+from quart import Quart, render_template, request, url_for, redirect, session, make_response, send_from_directory
+
+import assets
+import async_data_manager as adm
+import async_database_common as db
+import cache
+import data_manager as dm
+import image_store
+import passwords
+import web_common
+
+# same routes as server.py, served by an ASGI server, e.g. `hypercorn async_server:app`
+app = Quart(__name__, template_folder='templates')
+app.secret_key = 'ff'
+app.config['MAX_CONTENT_LENGTH'] = image_store.MAX_IMAGE_BYTES + 64 * 1024
+ANSWER_FRAGMENT_TTL = 3600
+
+
+def image_url(image, variant=None):
+    filename = image_store.image_filename(image, variant)
+    return url_for('static', filename=filename) if filename else None
+
+
+def asset_url(filename):
+    endpoint, filename = assets.resolve(filename)
+    return url_for(endpoint, filename=filename)
+
+
+app.jinja_env.globals['image_url'] = image_url
+app.jinja_env.globals['asset_url'] = asset_url
+
+
+@app.before_serving
+async def open_pool():
+    await db.get_pool()
+    adm.start(asyncio.get_running_loop())
+
+
+@app.after_serving
+async def close_pool():
+    # buffered vote and view counts are written out while the pool is still open
+    await adm.stop()
+    await db.close_pool()
+
+
+async def conditional_response(version, render):
+    if version is None:
+        return await render()
+    etag, last_modified = web_common.page_validators(version, request, session.get('user'))
+    if web_common.not_modified(request, etag, last_modified):
+        response = await make_response('', 304)
+    else:
+        response = await make_response(await render())
+    return web_common.set_validators(response, etag, last_modified)
+
+
+@app.route('/assets/<path:filename>')
+async def serve_asset(filename):
+    encoding, path = assets.choose_encoding(filename, request.accept_encodings)
+    response = await send_from_directory(assets.DIST_FOLDER, path, mimetype=mimetypes.guess_type(filename)[0])
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = assets.CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+@app.route('/')
+async def index():
+    version = await adm.get_listing_version()
+
+    async def render():
+        latest_questions = await adm.get_latest_questions(5, listing_version=dm.listing_cache_key(version))
+        return await render_template('index.html', latest_questions=latest_questions, session=session)
+
+    return await conditional_response(version, render)
+
+
+async def _questions_page(version, order_by, order_direction, tag_id=None):
+    return await adm.get_questions_page(order_by, order_direction, web_common.page_cursor(request.args),
+                                        tag_id=tag_id, listing_version=dm.listing_cache_key(version))
+
+
+@app.route("/list", methods=['GET'])
+async def list_questions():
+    version = await adm.get_listing_version()
+
+    async def render():
+        order_by, order_direction = web_common.sort_order(request.args)
+        page = await _questions_page(version, order_by, order_direction)
+        return await render_template('list.html',
+                                     questions=page['questions'],
+                                     next_cursor=page['next_cursor'],
+                                     prev_cursor=page['prev_cursor'],
+                                     order_by=order_by,
+                                     order_direction=order_direction)
+
+    return await conditional_response(version, render)
+
+
+@app.route("/tag/<tag_name>", methods=['GET'])
+async def list_questions_by_tag(tag_name):
+    tag_id = await adm.get_tag_id(tag_name)
+    if tag_id is None:
+        return "Error: Tag not found", 404
+    version = await adm.get_listing_version()
+
+    async def render():
+        order_by, order_direction = web_common.sort_order(request.args)
+        page = await _questions_page(version, order_by, order_direction, tag_id)
+        return await render_template('list.html',
+                                     questions=page['questions'],
+                                     next_cursor=page['next_cursor'],
+                                     prev_cursor=page['prev_cursor'],
+                                     order_by=order_by,
+                                     order_direction=order_direction,
+                                     tag_name=tag_name)
+
+    return await conditional_response(version, render)
+
+
+@app.route("/tags", methods=['GET'])
+async def tag_cloud():
+    tags = await adm.get_tag_cloud()
+    max_count = max((tag['question_count'] for tag in tags), default=1)
+    return await render_template('tags.html', tags=tags, max_count=max_count)
+
+
+@app.route('/question/<int:question_id>')
+async def display_question(question_id):
+    version = await adm.get_question_version(question_id)
+    if version is None:
+        return "Error: Question not found", 404
+    adm.update_question_views(question_id)
+
+    async def render():
+        page = await adm.load_question_page_at(question_id, version['revision'])
+        # templates render synchronously here, so the answer fragments are prepared up front
+        fragments = {answer['id']: await answer_fragment(answer) for answer in page['answers']}
+        return await render_template('question.html',
+                                     question=page['question'],
+                                     comments_to_question=page['comments'],
+                                     answers=page['answers'],
+                                     answer_html=lambda answer: fragments[answer['id']],
+                                     question_id=question_id,
+                                     tags=page['tags'])
+
+    return await conditional_response(version, render)
+
+
+async def answer_fragment(answer):
+    hit, cached = cache.get('answer_fragment', (answer['id'],))
+    if hit and cached[0] == answer['revision']:
+        return Markup(cached[1])
+    html = await render_template('_answer.html', answer=answer)
+    cache.set('answer_fragment', (answer['id'],), (answer['revision'], html), ANSWER_FRAGMENT_TTL)
+    return Markup(html)
+
+
+@app.route('/image/<int:question_id>')
+async def display_image(question_id):
+    link = await adm.get_image_link_by_question_id(question_id)
+    return await render_template('image.html', link=link)
+
+
+@app.route('/add_question', methods=['GET', 'POST'])
+async def add_question():
+    if request.method == 'GET':
+        return await render_template('add_question.html')
+    elif request.method == 'POST':
+        files = await request.files
+        form = await request.form
+        file = files.get('image')
+        image = None
+        if file is not None and file.filename != '':
+            try:
+                # hashing and writing the upload would block the event loop
+                image = await asyncio.get_running_loop().run_in_executor(None, image_store.save_upload, file)
+            except image_store.ImageRejected as error:
+                return f"Error: {error}", 400
+        new_question_id = await adm.add_question(form.get('title'), form.get('message'), image=image)
+        return redirect(url_for('display_question', question_id=new_question_id))
+
+
+@app.route("/question/<int:question_id>/new-answer", methods=['GET', 'POST'])
+async def add_answer(question_id):
+    if request.method == 'GET':
+        return await render_template('new_answer.html', question_id=question_id)
+    elif request.method == 'POST':
+        form = await request.form
+        await adm.add_answer(question_id, form.get('message'))
+        return redirect(url_for('display_question', question_id=question_id))
+
+
+@app.route("/question/<question_id>/delete", methods=["POST"])
+async def delete_question(question_id):
+    await adm.delete_question(question_id)
+    return redirect(url_for('list_questions'))
+
+
+@app.route('/question/<int:question_id>/edit', methods=['GET', 'POST'])
+async def edit_question(question_id):
+    if request.method == 'GET':
+        question = await adm.get_question_by_id(question_id)
+        question_length = len(question['title'])
+        return await render_template('edit_question.html',
+                                     question=question,
+                                     question_length=question_length)
+    elif request.method == 'POST':
+        form = await request.form
+        await adm.edit_question(question_id, form.get('title'), form.get('message'))
+        return redirect(url_for('display_question', question_id=question_id))
+
+
+@app.route('/answer/<int:answer_id>/delete', methods=['POST'])
+async def delete_answer(answer_id):
+    question_id = await adm.delete_answer(answer_id)
+    if question_id is not None:
+        return redirect(url_for('display_question', question_id=question_id))
+    else:
+        return "Error: Question ID not found"
+
+
+@app.route('/question/<int:question_id>/vote-up', methods=['POST'])
+async def vote_up(question_id):
+    if 'user' not in session:
+        return redirect(url_for('registration'))
+    await adm.vote('question', question_id, session['user'], 'up')
+    return redirect(url_for('list_questions'))
+
+
+@app.route('/question/<int:question_id>/vote-down', methods=['POST'])
+async def vote_down(question_id):
+    if 'user' not in session:
+        return redirect(url_for('registration'))
+    await adm.vote('question', question_id, session['user'], 'down')
+    return redirect(url_for('list_questions'))
+
+
+@app.route('/answer/<int:answer_id>/vote-up', methods=['POST'])
+async def vote_up_answer(answer_id):
+    if 'user' not in session:
+        return redirect(url_for('registration'))
+    await adm.vote('answer', answer_id, session['user'], 'up')
+    question_id = await adm.get_question_id_by_answer_id(answer_id)
+    return redirect(url_for('display_question', question_id=question_id))
+
+
+@app.route('/answer/<int:answer_id>/vote-down', methods=['POST'])
+async def vote_down_answer(answer_id):
+    if 'user' not in session:
+        return redirect(url_for('registration'))
+    await adm.vote('answer', answer_id, session['user'], 'down')
+    question_id = await adm.get_question_id_by_answer_id(answer_id)
+    return redirect(url_for('display_question', question_id=question_id))
+
+
+@app.route('/search_results')
+async def search_results():
+    search_phrase = request.args.get('q', '')
+    search = await adm.search_results(search_phrase, web_common.search_page(request.args)) if search_phrase else None
+    return await render_template('search_results.html', search_phrase=search_phrase,
+                                 results=web_common.search_listing(search), search=search)
+
+
+@app.route('/answer/<answer_id>/edit', methods=['GET', 'POST'])
+async def edit_answer(answer_id):
+    if request.method == 'GET':
+        answer = await adm.get_answer_by_id(answer_id)
+        return await render_template('edit_answer.html', answer=answer)
+    elif request.method == 'POST':
+        form = await request.form
+        question_id = await adm.edit_answer(answer_id, form.get('message'))
+        return redirect(url_for('display_question', question_id=question_id))
+
+
+@app.route('/question/<question_id>/new-tag', methods=['GET', 'POST'])
+async def add_tag(question_id):
+    if request.method == 'GET':
+        current_tags = await adm.get_existing_tags()
+        return await render_template('add_tag.html', question_id=question_id, current_tags=current_tags)
+    elif request.method == 'POST':
+        form = await request.form
+        tag_ids, new_tags = web_common.selected_tags(form)
+        if new_tags:
+            tag_ids += await adm.add_new_tags(new_tags)
+        await adm.add_tags(question_id, tag_ids)
+        return redirect(url_for('display_question', question_id=question_id))
+
+
+@app.route("/answer/<int:answer_id>/new-comment", methods=['GET', 'POST'])
+async def add_comment_to_answer(answer_id):
+    if request.method == 'GET':
+        return await render_template('add_comment_to_answer.html', answer_id=answer_id)
+    else:
+        form = await request.form
+        question_id = await adm.add_comment_to_answer(answer_id, form.get('comment'))
+        return redirect(url_for('display_question', question_id=question_id))
+
+
+@app.route("/question/<int:question_id>/new-comment", methods=['GET', 'POST'])
+async def add_comment_to_question(question_id):
+    if request.method == 'GET':
+        return await render_template('add_comment_to_question.html', question_id=question_id)
+    else:
+        form = await request.form
+        await adm.add_comment_to_question(question_id, form.get('comment'))
+        return redirect(url_for('display_question', question_id=question_id))
+
+
+@app.route("/question/<question_id>/tag/<tag_id>/delete")
+async def delete_tag(question_id, tag_id):
+    await adm.delete_tag_from_question(question_id, tag_id)
+    return redirect(url_for('display_question', question_id=question_id))
+
+
+@app.route("/comment/<comment_id>/edit", methods=['GET', 'POST'])
+async def edit_comment(comment_id):
+    if request.method == 'GET':
+        comment = await adm.get_comment_by_id(comment_id)
+        return await render_template('edit_comment.html', comment=comment)
+    elif request.method == 'POST':
+        form = await request.form
+        question_id = await adm.edit_comment(comment_id, form.get('message'))
+        return redirect(url_for('display_question', question_id=question_id))
+
+
+@app.route('/comments/<int:comment_id>/delete', methods=["POST"])
+async def delete_comment(comment_id):
+    question_id = await adm.delete_comment(comment_id)
+    if question_id is not None:
+        return redirect(url_for('display_question', question_id=question_id))
+    else:
+        return "Error: Comment ID not found"
+
+
+@app.route('/registration', methods=["GET", "POST"])
+async def registration():
+    if request.method == 'GET':
+        return await render_template('registration.html')
+    elif request.method == 'POST':
+        form = await request.form
+        try:
+            password_hash = await passwords.hash_password_async(form.get("password"))
+        except passwords.PasswordServiceBusy:
+            return "Error: Too many registrations at once, please try again", 503
+        user_id = await adm.register_user(form.get("email"), password_hash)
+        session["user"] = user_id
+        return redirect(url_for('index'))
+
+
+@app.route('/login', methods=["GET", "POST"])
+async def login():
+    if request.method == 'GET':
+        return await render_template('login.html')
+    form = await request.form
+    email = form.get("email", '')
+    password = form.get("password", '')
+    if passwords.login_throttled(email):
+        return await render_template('login.html', error='Too many failed attempts, please try again later'), 429
+    user = await adm.get_user_credentials(email)
+    try:
+        verified = user is not None and await passwords.verify_password_async(password, user['password'])
+    except passwords.PasswordServiceBusy:
+        return await render_template('login.html', error='Too many logins at once, please try again'), 503
+    if not verified:
+        passwords.record_login_failure(email)
+        return await render_template('login.html', error='Wrong email or password'), 401
+    passwords.record_login_success(email)
+    if passwords.needs_rehash(user['password']):
+        # see server.login
+        try:
+            await adm.update_password_hash(user['id'], await passwords.hash_password_async(password))
+        except passwords.PasswordServiceBusy:
+            pass
+    session["user"] = user['id']
+    return redirect(url_for('index'))
+
+
+@app.route('/logout')
+async def logout():
+    session.pop("user")
+    return redirect('/')
+
+
+if __name__ == "__main__":
+    app.run(debug=True)
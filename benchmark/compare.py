@@ -0,0 +1,54 @@
+import argparse
+import json
+import sys
+
+# a run regresses when a scenario is this much slower (p95) or issues more queries than the baseline
+DEFAULT_TOLERANCE = 0.10
+
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare(baseline, candidate, tolerance=DEFAULT_TOLERANCE):
+    rows, regressions = [], []
+    for name, new in sorted(candidate['scenarios'].items()):
+        old = baseline['scenarios'].get(name)
+        if old is None:
+            continue
+        change = (new['p95_ms'] - old['p95_ms']) / old['p95_ms'] if old['p95_ms'] else 0.0
+        rows.append((name, old['p95_ms'], new['p95_ms'], change, old['queries_per_request'],
+                     new['queries_per_request']))
+        if change > tolerance:
+            regressions.append(f'{name}: p95 {old["p95_ms"]}ms -> {new["p95_ms"]}ms ({change:+.0%})')
+        if (old['queries_per_request'] is not None and new['queries_per_request'] is not None
+                and new['queries_per_request'] > old['queries_per_request']):
+            regressions.append(f'{name}: queries per request {old["queries_per_request"]} '
+                               f'-> {new["queries_per_request"]}')
+        if new['errors'] > old['errors']:
+            regressions.append(f'{name}: errors {old["errors"]} -> {new["errors"]}')
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='compare two benchmark result files')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed relative p95 increase, e.g. 0.1 for 10%%')
+    args = parser.parse_args()
+
+    rows, regressions = compare(load(args.baseline), load(args.candidate), args.tolerance)
+    print(f"{'scenario':<32}{'p95 before':>12}{'p95 after':>12}{'change':>9}{'queries':>16}")
+    for name, old_p95, new_p95, change, old_queries, new_queries in rows:
+        print(f'{name:<32}{old_p95:>12.1f}{new_p95:>12.1f}{change:>+9.0%}{f"{old_queries} -> {new_queries}":>16}')
+    if regressions:
+        print('\nregressions:')
+        for regression in regressions:
+            print(f'  {regression}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+import argparse
+import datetime
+import http.cookiejar
+import itertools
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import data_manager as dm
+import database_common as db
+from benchmark.seed import VOCABULARY, zipf_weights
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+# relative frequency of each scenario in the request mix; reads dominate as on the live site
+SCENARIO_WEIGHTS = {
+    'index': 10,
+    **{f'list:{order_by}:{direction}': 2 for order_by in dm.QUESTION_SORT_KEYS for direction in ('asc', 'desc')},
+    'list:tag': 4,
+    'tags': 2,
+    'question': 40,
+    'search': 10,
+    'vote': 6,
+    'add_answer': 2,
+    'add_comment': 2,
+    'add_tag': 1,
+}
+PERCENTILES = (50, 95, 99)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # a POST is timed on its own, not together with the page it redirects to
+    def redirect_request(self, request, fp, code, message, headers, new_url):
+        return None
+
+
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return None
+    index = max(int(round(percent / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+class Dataset:
+    # ids and names the scenarios pick from; popular questions are requested far more often than the rest
+    def __init__(self):
+        connection = db.open_database()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT id FROM question ORDER BY vote_number DESC, id')
+                self.question_ids = [row[0] for row in cursor.fetchall()]
+                cursor.execute('SELECT id, name FROM tag ORDER BY id')
+                self.tags = cursor.fetchall()
+                cursor.execute("""
+                    SELECT (SELECT COUNT(*) FROM question), (SELECT COUNT(*) FROM answer),
+                           (SELECT COUNT(*) FROM comment), (SELECT COUNT(*) FROM tag)
+                """)
+                counts = cursor.fetchone()
+        finally:
+            connection.close()
+        if not self.question_ids:
+            raise SystemExit('no questions in the database, run python -m benchmark.seed first')
+        self.sizes = dict(zip(('questions', 'answers', 'comments', 'tags'), counts))
+        self.question_cum_weights = list(itertools.accumulate(zipf_weights(len(self.question_ids), exponent=0.8)))
+        self.word_cum_weights = list(itertools.accumulate(zipf_weights(len(VOCABULARY))))
+
+    def question_id(self, rng):
+        return rng.choices(self.question_ids, cum_weights=self.question_cum_weights)[0]
+
+    def search_phrase(self, rng):
+        return ' '.join(rng.choices(VOCABULARY, cum_weights=self.word_cum_weights, k=rng.randint(1, 2)))
+
+
+class Client:
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+                                                  _NoRedirect())
+
+    def request(self, path, form=None):
+        data = urllib.parse.urlencode(form, doseq=True).encode() if form is not None else None
+        started = time.perf_counter()
+        try:
+            with self.opener.open(self.base_url + path, data=data, timeout=self.timeout) as response:
+                response.read()
+                status, headers = response.status, response.headers
+        except urllib.error.HTTPError as error:
+            error.read()
+            status, headers = error.code, error.headers
+        except OSError:
+            return time.perf_counter() - started, None, None
+        queries = headers.get('X-Query-Count')
+        return time.perf_counter() - started, status, int(queries) if queries is not None else None
+
+    def register(self):
+        self.request('/registration', {'email': f'bench-{uuid.uuid4().hex}@example.com', 'password': 'benchmark'})
+
+
+def scenario_path(name, dataset, rng):
+    # returns the path to request and the form to post, or None for a GET
+    if name == 'index':
+        return '/', None
+    if name == 'list:tag':
+        return f'/tag/{urllib.parse.quote(rng.choice(dataset.tags)[1])}', None
+    if name.startswith('list:'):
+        _, order_by, direction = name.split(':')
+        return f'/list?order_by={order_by}&order_direction={direction}', None
+    if name == 'tags':
+        return '/tags', None
+    if name == 'question':
+        return f'/question/{dataset.question_id(rng)}', None
+    if name == 'search':
+        return '/search_results?' + urllib.parse.urlencode({'q': dataset.search_phrase(rng)}), None
+    question_id = dataset.question_id(rng)
+    if name == 'vote':
+        return f'/question/{question_id}/vote-{rng.choice(("up", "down"))}', {}
+    if name == 'add_answer':
+        return f'/question/{question_id}/new-answer', {'message': dataset.search_phrase(rng) + ' benchmark answer'}
+    if name == 'add_comment':
+        return f'/question/{question_id}/new-comment', {'comment': 'benchmark comment'}
+    if name == 'add_tag':
+        return f'/question/{question_id}/new-tag', {'tag': [rng.choice(dataset.tags)[0]]}
+    raise ValueError(f'Unknown scenario: {name}')
+
+
+def run(base_url, scenarios, total_requests, concurrency, warmup, timeout, random_seed):
+    dataset = Dataset()
+    names = list(scenarios)
+    weights = [scenarios[name] for name in names]
+    samples = {name: [] for name in names}
+    samples_lock = threading.Lock()
+    request_numbers = iter(range(total_requests))
+    numbers_lock = threading.Lock()
+
+    def worker(worker_number):
+        rng = random.Random(random_seed * 1000 + worker_number)
+        client = Client(base_url, timeout)
+        client.register()
+        for _ in range(warmup):
+            client.request(*scenario_path(rng.choices(names, weights)[0], dataset, rng))
+        while True:
+            with numbers_lock:
+                if next(request_numbers, None) is None:
+                    return
+            name = rng.choices(names, weights)[0]
+            elapsed, status, queries = client.request(*scenario_path(name, dataset, rng))
+            with samples_lock:
+                samples[name].append((elapsed, status, queries))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(worker, range(concurrency)))
+    wall_time = time.perf_counter() - started
+    return dataset, wall_time, samples
+
+
+def summarize(samples, wall_time):
+    latencies = sorted(elapsed * 1000 for elapsed, _, _ in samples)
+    queries = [count for _, _, count in samples if count is not None]
+    errors = sum(1 for _, status, _ in samples if status is None or status >= 400)
+    summary = {
+        'requests': len(samples),
+        'errors': errors,
+        'throughput': round(len(samples) / wall_time, 2),
+        'mean_ms': round(sum(latencies) / len(latencies), 2),
+        'max_ms': round(latencies[-1], 2),
+        # reported by the server in debug mode only, otherwise None
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+    }
+    for percent in PERCENTILES:
+        summary[f'p{percent}_ms'] = round(percentile(latencies, percent), 2)
+    return summary
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results):
+    print(f"{'scenario':<32}{'requests':>9}{'errors':>7}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'queries':>9}")
+    for name, summary in sorted(results.items()):
+        queries = summary['queries_per_request']
+        print(f"{name:<32}{summary['requests']:>9}{summary['errors']:>7}{summary['throughput']:>9.1f}"
+              f"{summary['p50_ms']:>9.1f}{summary['p95_ms']:>9.1f}{summary['p99_ms']:>9.1f}"
+              f"{queries if queries is not None else '-':>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='drive the AskMate routes under load and report latencies')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--requests', type=int, default=2000, help='total requests, spread over all workers')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--warmup', type=int, default=5, help='untimed requests per worker before measuring')
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIO_WEIGHTS), help='default: all of them')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--label', help='free text stored with the results, e.g. the change being measured')
+    parser.add_argument('--output', help=f'results file, default: a timestamped file in {RESULTS_FOLDER}')
+    args = parser.parse_args()
+
+    scenarios = {name: SCENARIO_WEIGHTS[name] for name in args.scenarios or SCENARIO_WEIGHTS}
+    started_at = datetime.datetime.now(datetime.timezone.utc)
+    dataset, wall_time, samples = run(args.base_url, scenarios, args.requests, args.concurrency, args.warmup,
+                                      args.timeout, args.seed)
+    results = {name: summarize(values, wall_time) for name, values in samples.items() if values}
+    total = summarize([sample for values in samples.values() for sample in values], wall_time)
+    print_report(results)
+    print(f"total: {total['requests']} requests in {wall_time:.1f}s, {total['throughput']} req/s, "
+          f"{total['errors']} errors")
+
+    report = {
+        'started_at': started_at.isoformat(),
+        'label': args.label,
+        'git_revision': git_revision(),
+        'base_url': args.base_url,
+        'concurrency': args.concurrency,
+        'dataset': dataset.sizes,
+        'wall_time': round(wall_time, 3),
+        'total': total,
+        'scenarios': results,
+    }
+    output = args.output or os.path.join(RESULTS_FOLDER, started_at.strftime('%Y%m%dT%H%M%SZ') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f'results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
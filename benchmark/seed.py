@@ -0,0 +1,146 @@
+import argparse
+import datetime
+import random
+
+import bcrypt
+import psycopg2.extras
+
+import database_common as db
+
+# search terms are drawn from this vocabulary with a Zipf-like skew, so a few words are very common
+VOCABULARY = (
+    'python flask postgres query index error list dict string function class module import loop '
+    'exception template session cookie request response server client database table column row '
+    'join select insert update delete transaction cursor connection pool thread process async await '
+    'test mock fixture deploy docker config environment variable path file read write json csv '
+    'parse format date time timezone unicode encoding bytes socket http url route form upload image '
+    'cache memory performance slow fast benchmark profile sort filter search tag vote answer comment '
+    'user password hash login logout permission role admin migration schema sequence trigger view '
+    'lambda generator iterator decorator closure scope global local argument keyword default return'
+).split()
+BATCH_SIZE = 1000
+# tail exponent for answers/comments per item: most questions get a few answers, some get dozens
+PARETO_ALPHA = 1.6
+
+
+def zipf_weights(count, exponent=1.1):
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+class Generator:
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+        self.word_weights = list(zipf_weights(len(VOCABULARY)))
+
+    def words(self, low, high):
+        count = self.random.randint(low, high)
+        return ' '.join(self.random.choices(VOCABULARY, weights=self.word_weights, k=count))
+
+    def skewed_count(self, maximum):
+        return min(int(self.random.paretovariate(PARETO_ALPHA)) - 1, maximum)
+
+    def timestamp_after(self, start, end):
+        span = max((end - start).total_seconds(), 1)
+        return start + datetime.timedelta(seconds=self.random.random() * span)
+
+
+def _insert(cursor, query, rows, fetch=False):
+    return psycopg2.extras.execute_values(cursor, query, rows, page_size=BATCH_SIZE, fetch=fetch)
+
+
+def seed(cursor, questions, users, tags, max_answers, max_comments, max_tags_per_question, random_seed):
+    generator = Generator(random_seed)
+    now = datetime.datetime.now().replace(microsecond=0)
+    start = now - datetime.timedelta(days=730)
+
+    password = bcrypt.hashpw(b'benchmark', bcrypt.gensalt(4)).decode()
+    user_rows = [(f'bench-{index}@example.com', password, generator.timestamp_after(start, now))
+                 for index in range(users)]
+    _insert(cursor, 'INSERT INTO users (email, password, registration_date) VALUES %s', user_rows)
+
+    tag_names = list(dict.fromkeys(generator.random.sample(VOCABULARY, min(tags, len(VOCABULARY)))))
+    tag_names += [f'topic-{index}' for index in range(tags - len(tag_names))]
+    tag_ids = [row[0] for row in _insert(cursor, 'INSERT INTO tag (name) VALUES %s RETURNING id',
+                                         [(name,) for name in tag_names], fetch=True)]
+    tag_weights = zipf_weights(len(tag_ids))
+
+    totals = {'users': users, 'tags': len(tag_ids), 'questions': 0, 'answers': 0, 'comments': 0, 'question_tags': 0}
+    for offset in range(0, questions, BATCH_SIZE):
+        batch = min(BATCH_SIZE, questions - offset)
+        question_rows = [(generator.timestamp_after(start, now),
+                          min(int(generator.random.paretovariate(1.2) * 10), 1000000),
+                          generator.skewed_count(500),
+                          generator.words(4, 12).capitalize() + '?',
+                          generator.words(20, 120))
+                         for _ in range(batch)]
+        inserted = _insert(cursor, """
+            INSERT INTO question (submission_time, view_number, vote_number, title, message)
+            VALUES %s RETURNING id, submission_time
+        """, question_rows, fetch=True)
+
+        answer_rows, question_comment_rows, tagging_rows = [], [], []
+        for question_id, submitted in inserted:
+            for _ in range(generator.skewed_count(max_answers)):
+                answer_rows.append((generator.timestamp_after(submitted, now), generator.skewed_count(200),
+                                    question_id, generator.words(10, 80), ''))
+            for _ in range(generator.skewed_count(max_comments)):
+                question_comment_rows.append((question_id, generator.words(3, 25),
+                                              generator.timestamp_after(submitted, now), 0))
+            count = generator.random.randint(0, max_tags_per_question)
+            for tag_id in set(generator.random.choices(tag_ids, weights=tag_weights, k=count)):
+                tagging_rows.append((question_id, tag_id))
+
+        answers = _insert(cursor, """
+            INSERT INTO answer (submission_time, vote_number, question_id, message, image)
+            VALUES %s RETURNING id, submission_time
+        """, answer_rows, fetch=True) if answer_rows else []
+        answer_comment_rows = [(answer_id, generator.words(3, 25), generator.timestamp_after(submitted, now), 0)
+                               for answer_id, submitted in answers
+                               for _ in range(generator.skewed_count(max_comments))]
+        if question_comment_rows:
+            _insert(cursor, """
+                INSERT INTO comment (question_id, message, submission_time, edited_count) VALUES %s
+            """, question_comment_rows)
+        if answer_comment_rows:
+            _insert(cursor, """
+                INSERT INTO comment (answer_id, message, submission_time, edited_count) VALUES %s
+            """, answer_comment_rows)
+        if tagging_rows:
+            _insert(cursor, 'INSERT INTO question_tag (question_id, tag_id) VALUES %s', tagging_rows)
+
+        totals['questions'] += len(inserted)
+        totals['answers'] += len(answers)
+        totals['comments'] += len(question_comment_rows) + len(answer_comment_rows)
+        totals['question_tags'] += len(tagging_rows)
+        print(f"{totals['questions']}/{questions} questions, {totals['answers']} answers, "
+              f"{totals['comments']} comments")
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fill the AskMate database with synthetic benchmark data')
+    parser.add_argument('--questions', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--tags', type=int, default=200)
+    parser.add_argument('--max-answers', type=int, default=60, help='cap on answers per question')
+    parser.add_argument('--max-comments', type=int, default=30, help='cap on comments per question or answer')
+    parser.add_argument('--max-tags', type=int, default=5, help='cap on tags per question')
+    parser.add_argument('--seed', type=int, default=0, help='random seed, the same seed gives the same data')
+    parser.add_argument('--truncate', action='store_true', help='delete all existing rows first')
+    args = parser.parse_args()
+
+    connection = db.open_database()
+    try:
+        with connection.cursor() as cursor:
+            if args.truncate:
+                cursor.execute('TRUNCATE question, answer, comment, tag, question_tag, vote, users '
+                               'RESTART IDENTITY CASCADE')
+            totals = seed(cursor, args.questions, args.users, args.tags, args.max_answers, args.max_comments,
+                          args.max_tags, args.seed)
+    finally:
+        connection.close()
+    print(', '.join(f'{count} {name}' for name, count in totals.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+import io
+import itertools
+import json
+import os
+
+import psycopg2
+from psycopg2 import sql
+
+import database_common as db
+
+# parents before children, so ids can be kept and every foreign key already points at an imported row
+TABLES = ('users', 'tag', 'question', 'answer', 'vote', 'comment', 'question_tag')
+# maintained by triggers on insert, so they are neither exported nor imported
+DERIVED_COLUMNS = ('search_vector', 'answer_count', 'comment_count', 'last_activity_at')
+# table -> tables filled by triggers from its rows, emptied together with it
+DERIVED_TABLES = {'tag': ('tag_question_count',)}
+FORMATS = ('csv', 'jsonl')
+BATCH_SIZE = 50000
+# CSV quoting that never triggers: row_to_json already escapes every control character,
+# so each JSON document comes out of COPY verbatim, one per line
+JSONL_COPY_OPTIONS = "FORMAT csv, QUOTE e'\\x01', DELIMITER e'\\x02'"
+
+
+def _columns(cursor, table):
+    cursor.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %(table)s
+        ORDER BY ordinal_position;
+    """, {'table': table})
+    return [row[0] for row in cursor.fetchall() if row[0] not in DERIVED_COLUMNS]
+
+
+def _path(folder, table, file_format):
+    return os.path.join(folder, f'{table}.{file_format}')
+
+
+def export_data(folder, file_format='csv', tables=TABLES):
+    os.makedirs(folder, exist_ok=True)
+    connection = db.open_database()
+    # one snapshot for every table, so the files agree with each other while the site keeps writing
+    connection.set_session(isolation_level='REPEATABLE READ', readonly=True, autocommit=False)
+    counts = {}
+    try:
+        with connection.cursor() as cursor:
+            for table in tables:
+                columns = _columns(cursor, table)
+                select = sql.SQL('SELECT {columns} FROM {table} ORDER BY {order}').format(
+                    columns=sql.SQL(', ').join(map(sql.Identifier, columns)),
+                    table=sql.Identifier(table),
+                    order=sql.SQL(', ').join(map(sql.Identifier, ['id'] if 'id' in columns else columns)))
+                if file_format == 'csv':
+                    query = sql.SQL('COPY ({select}) TO STDOUT WITH (FORMAT csv, HEADER)').format(select=select)
+                else:
+                    query = sql.SQL('COPY (SELECT row_to_json(data) FROM ({select}) AS data) TO STDOUT WITH ({options})'
+                                    ).format(select=select, options=sql.SQL(JSONL_COPY_OPTIONS))
+                with open(_path(folder, table, file_format), 'w', encoding='utf-8', newline='') as file:
+                    cursor.copy_expert(query.as_string(cursor), file)
+                counts[table] = cursor.rowcount
+                yield table, counts[table]
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def _csv_records(file):
+    # yields whole CSV records; a record continues on the next line while a quoted field is still open
+    record = ''
+    for line in file:
+        record += line
+        if record.count('"') % 2 == 0:
+            yield record
+            record = ''
+    if record:
+        yield record
+
+
+def _csv_field(value):
+    # unquoted empty is NULL for COPY, so every non-NULL value is quoted to keep '' apart from NULL
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _read_csv(path):
+    file = open(path, encoding='utf-8', newline='')
+    records = _csv_records(file)
+    header = next(records, '').strip()
+    columns = header.split(',') if header else []
+    return file, columns, records
+
+
+def _read_jsonl(path):
+    file = open(path, encoding='utf-8')
+    lines = (line for line in file if line.strip())
+    first = next(lines, None)
+    if first is None:
+        return file, [], iter(())
+    columns = list(json.loads(first))
+    rows = (json.loads(line) for line in itertools.chain([first], lines))
+    records = (','.join(_csv_field(row.get(column)) for column in columns) + '\n' for row in rows)
+    return file, columns, records
+
+
+def _reset_sequence(cursor, table):
+    cursor.execute(sql.SQL("""
+        SELECT setval(pg_get_serial_sequence(%(table)s, 'id'), COALESCE(MAX(id), 1), MAX(id) IS NOT NULL)
+        FROM {table};
+    """).format(table=sql.Identifier(table)), {'table': table})
+
+
+def import_data(folder, tables=TABLES, batch_size=BATCH_SIZE, truncate=False):
+    connection = db.open_database()
+    connection.autocommit = False
+    try:
+        with connection.cursor() as cursor:
+            if truncate:
+                # no CASCADE: a table that references one of these but is not being imported must not be emptied
+                truncated = list(tables) + [derived for table in tables for derived in DERIVED_TABLES.get(table, ())]
+                try:
+                    cursor.execute(sql.SQL('TRUNCATE {tables} RESTART IDENTITY').format(
+                        tables=sql.SQL(', ').join(map(sql.Identifier, truncated))))
+                except psycopg2.errors.FeatureNotSupported as error:
+                    raise ValueError(f'Cannot truncate only these tables: {error.diag.message_detail}') from error
+                cursor.execute('DELETE FROM bulk_import_progress WHERE source = %(source)s',
+                               {'source': os.path.abspath(folder)})
+                connection.commit()
+            for table in tables:
+                for file_format, reader in (('csv', _read_csv), ('jsonl', _read_jsonl)):
+                    path = _path(folder, table, file_format)
+                    if os.path.exists(path):
+                        break
+                else:
+                    continue
+                file, columns, records = reader(path)
+                with file:
+                    yield from _import_table(connection, cursor, table, os.path.abspath(folder), columns,
+                                             records, batch_size)
+                if 'id' in columns:
+                    _reset_sequence(cursor, table)
+                    connection.commit()
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def _import_table(connection, cursor, table, source, columns, records, batch_size):
+    cursor.execute("""
+        SELECT rows_done FROM bulk_import_progress
+        WHERE source = %(source)s AND table_name = %(table)s;
+    """, {'source': source, 'table': table})
+    progress = cursor.fetchone()
+    rows_done = already_loaded = progress[0] if progress else 0
+    # the header is the file's own, so files written by an older schema still load
+    copy = sql.SQL('COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)').format(
+        table=sql.Identifier(table),
+        columns=sql.SQL(', ').join(sql.Identifier(column) for column in columns)).as_string(cursor)
+    batch = io.StringIO()
+    batch_rows = 0
+    # records are still read one at a time while skipping, so resuming needs no more memory than a batch
+    for record in itertools.islice(records, already_loaded, None):
+        batch.write(record)
+        batch_rows += 1
+        if batch_rows == batch_size:
+            rows_done = _load_batch(connection, cursor, table, source, copy, batch, batch_rows, rows_done)
+            yield table, rows_done
+            batch = io.StringIO()
+            batch_rows = 0
+    if batch_rows:
+        rows_done = _load_batch(connection, cursor, table, source, copy, batch, batch_rows, rows_done)
+    yield table, rows_done
+
+
+def _load_batch(connection, cursor, table, source, copy, batch, batch_rows, rows_done):
+    batch.seek(0)
+    cursor.copy_expert(copy, batch)
+    rows_done += batch_rows
+    # recorded in the batch's own transaction: after a crash the batch is either loaded and counted, or neither
+    cursor.execute("""
+        INSERT INTO bulk_import_progress (source, table_name, rows_done)
+        VALUES (%(source)s, %(table)s, %(rows_done)s)
+        ON CONFLICT (source, table_name) DO UPDATE SET rows_done = EXCLUDED.rows_done;
+    """, {'source': source, 'table': table, 'rows_done': rows_done})
+    connection.commit()
+    return rows_done
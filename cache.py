@@ -0,0 +1,202 @@
+import functools
+import inspect
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_BACKEND = os.environ.get('ASKMATE_CACHE_BACKEND', 'memory')
+CACHE_PATH = os.environ.get('ASKMATE_CACHE_PATH', '/tmp/askmate-cache.sqlite3')
+CACHE_MAX_ENTRIES = int(os.environ.get('ASKMATE_CACHE_MAX_ENTRIES', 1000))
+
+
+# in-process LRU with per-entry expiry, enough for a single worker
+class MemoryBackend:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def delete_namespace(self, namespace):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == namespace]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self):
+        return len(self._entries)
+
+
+# a local SQLite file shared by every worker process on the machine, so an invalidation reaches all of them
+class SqliteBackend:
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._connection().execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                namespace TEXT NOT NULL,
+                value BLOB NOT NULL,
+                expires_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            )
+        """)
+        self._connection().execute('CREATE INDEX IF NOT EXISTS cache_namespace_idx ON cache (namespace)')
+        self._connection().execute('CREATE INDEX IF NOT EXISTS cache_used_at_idx ON cache (used_at)')
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _key(key):
+        return repr(key)
+
+    def get(self, key):
+        now = time.time()
+        row = self._connection().execute('SELECT value, expires_at FROM cache WHERE key = ?',
+                                         (self._key(key),)).fetchone()
+        if row is None or row[1] < now:
+            return False, None
+        self._connection().execute('UPDATE cache SET used_at = ? WHERE key = ?', (now, self._key(key)))
+        return True, pickle.loads(row[0])
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        connection = self._connection()
+        connection.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)',
+                           (self._key(key), key[0], pickle.dumps(value), now + ttl, now))
+        connection.execute("""
+            DELETE FROM cache WHERE expires_at < ? OR key IN (
+                SELECT key FROM cache ORDER BY used_at DESC LIMIT -1 OFFSET ?
+            )
+        """, (now, self.max_entries))
+
+    def delete(self, key):
+        self._connection().execute('DELETE FROM cache WHERE key = ?', (self._key(key),))
+
+    def delete_namespace(self, namespace):
+        self._connection().execute('DELETE FROM cache WHERE namespace = ?', (namespace,))
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+    def size(self):
+        return self._connection().execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+
+def create_backend(name=CACHE_BACKEND):
+    if name == 'memory':
+        return MemoryBackend(CACHE_MAX_ENTRIES)
+    elif name == 'sqlite':
+        return SqliteBackend(CACHE_PATH, CACHE_MAX_ENTRIES)
+    raise ValueError(f'Unknown cache backend: {name}')
+
+
+backend = create_backend()
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _count(namespace, outcome):
+    with _stats_lock:
+        counters = _stats.setdefault(namespace, {'hits': 0, 'misses': 0, 'invalidations': 0})
+        counters[outcome] += 1
+
+
+def cached(namespace, ttl):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key = (namespace, args + tuple(sorted(kwargs.items())))
+            hit, value = backend.get(key)
+            if hit:
+                _count(namespace, 'hits')
+                return value
+            _count(namespace, 'misses')
+            value = function(*args, **kwargs)
+            backend.set(key, value, ttl)
+            return value
+
+        @functools.wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            key = (namespace, args + tuple(sorted(kwargs.items())))
+            hit, value = backend.get(key)
+            if hit:
+                _count(namespace, 'hits')
+                return value
+            _count(namespace, 'misses')
+            value = await function(*args, **kwargs)
+            backend.set(key, value, ttl)
+            return value
+
+        return async_wrapper if inspect.iscoroutinefunction(function) else wrapper
+
+    return decorator
+
+
+# key is the tuple invalidate(namespace, *key) deletes, as for the entries of a cached() function
+def get(namespace, key):
+    hit, value = backend.get((namespace, key))
+    _count(namespace, 'hits' if hit else 'misses')
+    return hit, value
+
+
+def set(namespace, key, value, ttl):
+    backend.set((namespace, key), value, ttl)
+
+
+def get_or_set(namespace, key, ttl, create):
+    hit, value = get(namespace, key)
+    if not hit:
+        value = create()
+        set(namespace, key, value, ttl)
+    return value
+
+
+def invalidate(namespace, *args):
+    _count(namespace, 'invalidations')
+    if args:
+        backend.delete((namespace, args))
+    else:
+        backend.delete_namespace(namespace)
+
+
+def stats():
+    with _stats_lock:
+        namespaces = {namespace: dict(counters) for namespace, counters in _stats.items()}
+    return {'backend': type(backend).__name__, 'entries': backend.size(), 'namespaces': namespaces}
@@ -0,0 +1,125 @@
+import atexit
+import threading
+import time
+import traceback
+
+
+# aggregates counter increments in memory and writes them out in batches from a background thread
+class CounterBuffer:
+
+    def __init__(self, flush_function, interval, threshold):
+        self.flush_function = flush_function
+        self.interval = interval
+        self.threshold = threshold
+        self._pending = {}
+        self._pending_total = 0
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._stats = {
+            'flushes': 0,
+            'failed_flushes': 0,
+            'flushed_keys': 0,
+            'flushed_increments': 0,
+            'last_flush_seconds': 0.0,
+            'last_flush_at': None,
+        }
+        atexit.register(self.stop)
+
+    def add(self, key, amount=1):
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + amount
+            self._pending_total += abs(amount)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            over_threshold = self._pending_total >= self.threshold
+            if self._thread is None and not self._stopped:
+                self._thread = threading.Thread(target=self._run, name='counter-buffer', daemon=True)
+                self._thread.start()
+        if over_threshold:
+            # the request thread never writes; it only wakes the flusher early
+            self._wakeup.set()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._pending_total = 0
+                self._oldest = None
+            if not pending:
+                return
+            started = time.monotonic()
+            try:
+                self.flush_function(sorted(pending.items()))
+            except Exception:
+                traceback.print_exc()
+                self._stats['failed_flushes'] += 1
+                self._restore(pending)
+                return
+            self._stats['flushes'] += 1
+            self._stats['flushed_keys'] += len(pending)
+            self._stats['flushed_increments'] += sum(abs(amount) for amount in pending.values())
+            self._stats['last_flush_seconds'] = time.monotonic() - started
+            self._stats['last_flush_at'] = time.time()
+
+    def _restore(self, pending):
+        with self._lock:
+            for key, amount in pending.items():
+                self._pending[key] = self._pending.get(key, 0) + amount
+                self._pending_total += abs(amount)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        self.flush()
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending_keys'] = len(self._pending)
+            stats['pending_increments'] = self._pending_total
+            stats['lag_seconds'] = time.monotonic() - self._oldest if self._oldest is not None else 0.0
+        stats['flush_interval'] = self.interval
+        stats['flush_threshold'] = self.threshold
+        return stats
+
+
+# counts hits per key in fixed windows; a key seen more than `threshold` times in the current window is hot
+class RateTracker:
+    def __init__(self, window, threshold):
+        self.window = window
+        self.threshold = threshold
+        self._counts = {}
+        self._window_start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def hit(self, key):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._window_start >= self.window:
+                self._counts = {}
+                self._window_start = now
+            self._counts[key] = self._counts.get(key, 0) + 1
+            return self._counts[key] > self.threshold
+
+    def exceeded(self, key):
+        # like hit() but without counting
+        with self._lock:
+            if time.monotonic() - self._window_start >= self.window:
+                return False
+            return self._counts.get(key, 0) > self.threshold
+
+    def reset(self, key):
+        with self._lock:
+            self._counts.pop(key, None)
@@ -1,281 +1,807 @@
+import base64
+import json
+import os
+
+import cache
+import counter_buffer
 import database_common as db
+import image_store
+import tag_dictionary
 import util
-import bcrypt
+from psycopg2 import sql
+
+# the SQL type of each sort key, needed to cast the text value carried in a page cursor
+SORT_COLUMN_TYPES = {
+    'submission_time': 'timestamp',
+    'view_number': 'integer',
+    'vote_number': 'integer',
+    'title': 'text',
+    'answer_count': 'integer',
+    'last_activity_at': 'timestamp',
+}
+QUESTION_SORT_KEYS = tuple(SORT_COLUMN_TYPES)
+QUESTIONS_PER_PAGE = 20
+SEARCH_RESULTS_PER_PAGE = 20
+SEARCH_ANSWERS_PER_RESULT = 3
+SEARCHABLE_TABLES = ('question', 'answer')
+# ts_headline shows up to this many words of a message around the best match, titles are shown whole
+SEARCH_HEADLINE_WORDS = 35
+SEARCH_HEADLINE_OPTIONS = f'StartSel={util.HIGHLIGHT_START}, StopSel={util.HIGHLIGHT_STOP}'
+VIEW_FLUSH_INTERVAL = float(os.environ.get('VIEW_FLUSH_INTERVAL', 5))
+VIEW_FLUSH_THRESHOLD = int(os.environ.get('VIEW_FLUSH_THRESHOLD', 1000))
+MODERATION_TABLES = ('question', 'answer', 'comment')
+LATEST_QUESTIONS_TTL = 30
+QUESTION_PAGE_TTL = 60
+QUESTIONS_PAGE_TTL = 30
+TAG_CLOUD_TTL = 60
+TAG_CLOUD_SIZE = 100
+TAG_DICTIONARY_MAX_AGE = float(os.environ.get('TAG_DICTIONARY_MAX_AGE', 300))
+VOTE_VALUES = {'up': 1, 'down': -1}
+VOTABLE_TABLES = ('question', 'answer')
+# an item voted on more than HOT_VOTE_THRESHOLD times within HOT_VOTE_WINDOW seconds gets its counter batched
+HOT_VOTE_WINDOW = float(os.environ.get('HOT_VOTE_WINDOW', 10))
+HOT_VOTE_THRESHOLD = int(os.environ.get('HOT_VOTE_THRESHOLD', 20))
+VOTE_FLUSH_INTERVAL = float(os.environ.get('VOTE_FLUSH_INTERVAL', 2))
+VOTE_FLUSH_THRESHOLD = int(os.environ.get('VOTE_FLUSH_THRESHOLD', 500))
+
+
+def invalidate_listings():
+    def invalidate():
+        cache.invalidate('latest_questions')
+        cache.invalidate('questions_page')
+
+    db.on_commit(invalidate)
+
+
+def invalidate_question(question_id, listings=False):
+    db.on_commit(lambda: cache.invalidate('question_page', int(question_id)))
+    if listings:
+        invalidate_listings()
+
+
+def invalidate_answer(answer_id):
+    db.on_commit(lambda: cache.invalidate('answer_fragment', int(answer_id)))
+
+
+def invalidate_tagging(question_id):
+    invalidate_question(question_id, listings=True)
+    db.on_commit(lambda: cache.invalidate('tag_cloud'))
+
+
+QUESTION_BY_ID_QUERY = """
+    SELECT * FROM question
+    WHERE id = %(question_id)s;
+"""
 
 
-def get_questions_sorted_by_date(cursor):
-    query = """
-        SELECT * FROM question ORDER BY submission_time DESC
-    """
-    cursor.execute(query)
-    return cursor.fetchall()
+@db.connection_handler
+def get_question_by_id(cursor, question_id):
+    cursor.execute_prepared('get_question_by_id', QUESTION_BY_ID_QUERY, {'question_id': question_id})
+    return cursor.fetchone()
+
+
+QUESTION_VERSION_QUERY = """
+    SELECT revision, last_modified FROM question
+    WHERE id = %(question_id)s;
+"""
 
 
 @db.connection_handler
-def display_questions(cursor):
-    return get_questions_sorted_by_date(cursor)
+def get_question_version(cursor, question_id):
+    cursor.execute_prepared('get_question_version', QUESTION_VERSION_QUERY, {'question_id': question_id})
+    return cursor.fetchone()
+
+
+# additions and deletions bump site_revision, every other change moves a question's last_modified
+LISTING_VERSION_QUERY = """
+    SELECT (SELECT revision FROM site_revision) AS revision,
+           (SELECT MAX(last_modified) FROM question) AS last_modified;
+"""
 
 
 @db.connection_handler
-def get_question_by_id(cursor, question_id):
-    query = """
-        SELECT * FROM question
-        WHERE id = %(question_id)s;
-    """
-    cursor.execute(query, {'question_id': question_id})
+def get_listing_version(cursor):
+    cursor.execute_prepared('get_listing_version', LISTING_VERSION_QUERY)
     return cursor.fetchone()
 
 
+QUESTION_PAGE_QUERY = """
+    SELECT question.*,
+        (SELECT COALESCE(jsonb_agg(
+                    to_jsonb(answer) - 'search_vector' || jsonb_build_object(
+                        'submission_time', to_char(answer.submission_time, 'YYYY-MM-DD HH24:MI:SS'),
+                        'comments', (SELECT COALESCE(jsonb_agg(
+                                            to_jsonb(comment) || jsonb_build_object(
+                                                'submission_time',
+                                                to_char(comment.submission_time, 'YYYY-MM-DD HH24:MI:SS'))
+                                            ORDER BY comment.submission_time DESC), '[]'::jsonb)
+                                     FROM comment
+                                     WHERE comment.answer_id = answer.id))
+                    ORDER BY answer.submission_time DESC), '[]'::jsonb)
+         FROM answer
+         WHERE answer.question_id = question.id) AS page_answers,
+        (SELECT COALESCE(jsonb_agg(
+                    to_jsonb(comment) || jsonb_build_object(
+                        'submission_time', to_char(comment.submission_time, 'YYYY-MM-DD HH24:MI:SS'))
+                    ORDER BY comment.submission_time DESC), '[]'::jsonb)
+         FROM comment
+         WHERE comment.question_id = question.id) AS page_comments,
+        (SELECT COALESCE(jsonb_agg(jsonb_build_object(
+                    'question_id', question_tag.question_id, 'tag_id', tag.id, 'name', tag.name)
+                    ORDER BY tag.name), '[]'::jsonb)
+         FROM question_tag
+         JOIN tag ON question_tag.tag_id = tag.id
+         WHERE question_tag.question_id = question.id) AS page_tags
+    FROM question
+    WHERE question.id = %(question_id)s;
+"""
+
+
+def question_page(question):
+    if question is None:
+        return None
+    question.pop('search_vector', None)
+    return {
+        'answers': question.pop('page_answers'),
+        'comments': question.pop('page_comments'),
+        'tags': question.pop('page_tags'),
+        'question': question,
+    }
+
+
+@cache.cached('question_page', QUESTION_PAGE_TTL)
 @db.connection_handler
-def get_answers_for_question(cursor, question_id):
-    query = """
-        SELECT * FROM answer
-        WHERE question_id = %(question_id)s
-        ORDER BY submission_time DESC;
-    """
-    cursor.execute(query, {'question_id': question_id})
-    return cursor.fetchall()
+def load_question_page(cursor, question_id):
+    cursor.execute_prepared('load_question_page', QUESTION_PAGE_QUERY, {'question_id': question_id})
+    return question_page(cursor.fetchone())
+
+
+def listing_cache_key(version):
+    return (version['revision'], version['last_modified']) if version is not None else None
+
+
+def load_question_page_at(question_id, revision):
+    # a reader can refill the cache with pre-commit rows right after the on_commit invalidation;
+    # such a page is older than the revision the ETag is built from, so it is dropped and read again
+    page = load_question_page(question_id)
+    if page is not None and page['question']['revision'] < revision:
+        cache.invalidate('question_page', int(question_id))
+        page = load_question_page(question_id)
+    return page
+
+
+ADD_QUESTION_QUERY = """
+    INSERT INTO question (submission_time, view_number, vote_number, title, message, image)
+    VALUES (LOCALTIMESTAMP(0), 0, 0, %(title)s, %(message)s, %(image)s)
+    RETURNING id;
+"""
 
 
 @db.connection_handler
-def add_question(cursor, title, message, image):
-    current_timestamp = util.get_current_timestamp()
-    image_path = f'images/{image}'
-    new_question = {
-        'submission_time': current_timestamp,
-        'view_number': 0,
-        'vote_number': 0,
-        'title': title,
-        'message': message,
-        'image': image_path
-    }
-    query = """
-            INSERT INTO question (submission_time, view_number, vote_number, title, message, image)
-            VALUES (%(submission_time)s, %(view_number)s, %(vote_number)s, %(title)s, %(message)s, %(image)s);
-            SELECT id FROM question
-            WHERE message=%(message)s;
-        """
-    cursor.execute(query, new_question)
+def add_question(cursor, title, message, image=None):
+    cursor.execute(ADD_QUESTION_QUERY, {'title': title, 'message': message, 'image': image})
+    invalidate_listings()
     return cursor.fetchone()['id']
 
 
+ADD_ANSWER_QUERY = """
+    INSERT INTO answer (submission_time, vote_number, question_id, message, image)
+    VALUES (LOCALTIMESTAMP(0), 0, %(question_id)s, %(message)s, '')
+    RETURNING id;
+"""
+
+
 @db.connection_handler
 def add_answer(cursor, question_id, message):
-    query = """
-        INSERT INTO answer (submission_time, vote_number, question_id, message, image)
-        VALUES (CURRENT_TIMESTAMP, 0, %(question_id)s, %(message)s, '');
-    """
-    cursor.execute(query, {'question_id': question_id, 'message': message})
-    return cursor.lastrowid
-
-
-@db.connection_handler
-def delete_question(cursor, question_id):
-
-    query_1 = """
-        DELETE FROM question WHERE id = %(question_id)s
-        """
-    query_2 = """
-            DELETE FROM answer WHERE question_id = %(question_id)s
-        """
-    query_3 = """
-        DELETE FROM comment WHERE comment.question_id = %(question_id)s
-        """
-    query_4 = """
-        DELETE FROM comment 
-        USING answer WHERE comment.answer_id = answer.id
-        AND answer.question_id = %(question_id)s;
-        """
-    query_5 = """
-        DELETE FROM question_tag 
-        WHERE question_id = %(question_id)s
-        """
-    cursor.execute(query_5, {'question_id': question_id})
-    cursor.execute(query_4, {'question_id': question_id})
-    cursor.execute(query_3, {'question_id': question_id})
-    cursor.execute(query_2, {'question_id': question_id})
-    cursor.execute(query_1, {'question_id': question_id})
-
-
-@db.connection_handler
-def delete_answer(cursor, answer_id):
-    get_answer_id_query = """
-        SELECT question_id FROM answer WHERE id = %(answer_id)s;
-    """
-    cursor.execute(get_answer_id_query, {'answer_id': answer_id})
-    question_id = cursor.fetchone()['question_id']
-    query_1 = """
-        DELETE FROM answer 
-        WHERE id = %(answer_id)s;
-        """
-    query_2 = """
-        DELETE FROM comment WHERE answer_id = %(answer_id)s;
-        """
-    cursor.execute(query_2, {'answer_id': answer_id})
-    cursor.execute(query_1, {'answer_id': answer_id})
-    return question_id
+    cursor.execute(ADD_ANSWER_QUERY, {'question_id': question_id, 'message': message})
+    invalidate_question(question_id, listings=True)
+    return cursor.fetchone()['id']
+
+
+def _moderation_filter(table, ids=None, submitted_before=None, max_vote_number=None):
+    # table is one of MODERATION_TABLES, named by the callers below
+    conditions = []
+    params = {}
+    if ids is not None:
+        conditions.append(f'{table}.id = ANY(%(ids)s)')
+        params['ids'] = [int(item_id) for item_id in ids]
+    if submitted_before is not None:
+        conditions.append(f'{table}.submission_time < %(submitted_before)s')
+        params['submitted_before'] = submitted_before
+    if max_vote_number is not None:
+        if table == 'comment':
+            raise ValueError('Comments have no votes to filter on')
+        conditions.append(f'{table}.vote_number <= %(max_vote_number)s')
+        params['max_vote_number'] = max_vote_number
+    if not conditions:
+        raise ValueError('Refusing to delete without an id list or a filter')
+    return ' AND '.join(conditions), params
+
+
+def _remove_orphaned_images(deleted):
+    images = {row['orphaned_image'] for row in deleted if row['orphaned_image']}
+    if images:
+        # only once the rows are really gone - a rolled back delete must keep its files
+        db.on_commit(lambda: image_store.remove_images(images))
+
+
+# an image can be shared by several rows, it is only orphaned when no surviving question or answer uses it
+# '' is what rows without an image hold, so it is excluded to let the partial image indexes answer the lookups
+ORPHANED_IMAGE = """
+    CASE WHEN deleted.image <> ''
+          AND NOT EXISTS (SELECT 1 FROM question
+                          WHERE question.image = deleted.image AND question.image <> ''
+                          AND question.id NOT IN (SELECT id FROM doomed_questions))
+          AND NOT EXISTS (SELECT 1 FROM answer
+                          WHERE answer.image = deleted.image AND answer.image <> ''
+                          AND answer.id NOT IN (SELECT id FROM doomed_answers))
+         THEN deleted.image END AS orphaned_image
+"""
+
+
+DELETE_QUESTIONS_QUERY = """
+    WITH doomed_questions AS (
+        SELECT id FROM question WHERE {condition}
+    ), doomed_answers AS (
+        SELECT id FROM answer WHERE question_id IN (SELECT id FROM doomed_questions)
+    ), deleted_question_comments AS (
+        DELETE FROM comment WHERE question_id IN (SELECT id FROM doomed_questions)
+    ), deleted_answer_comments AS (
+        DELETE FROM comment WHERE answer_id IN (SELECT id FROM doomed_answers)
+    ), deleted_tags AS (
+        DELETE FROM question_tag WHERE question_id IN (SELECT id FROM doomed_questions)
+    ), deleted_answers AS (
+        DELETE FROM answer WHERE id IN (SELECT id FROM doomed_answers)
+        RETURNING 'answer' AS kind, id, question_id, image
+    ), deleted_questions AS (
+        DELETE FROM question WHERE id IN (SELECT id FROM doomed_questions)
+        RETURNING 'question' AS kind, id, id AS question_id, image
+    ), deleted AS (
+        SELECT * FROM deleted_questions
+        UNION ALL
+        SELECT * FROM deleted_answers
+    )
+    SELECT deleted.kind, deleted.id, deleted.question_id, {orphaned_image}
+    FROM deleted;
+"""
+
+
+def delete_questions_query(ids=None, submitted_before=None, max_vote_number=None):
+    condition, params = _moderation_filter('question', ids, submitted_before, max_vote_number)
+    return DELETE_QUESTIONS_QUERY.format(condition=condition, orphaned_image=ORPHANED_IMAGE), params
+
+
+def questions_deleted(deleted):
+    _remove_orphaned_images(deleted)
+    question_ids = [row['id'] for row in deleted if row['kind'] == 'question']
+    for question_id in question_ids:
+        invalidate_question(question_id)
+    invalidate_listings()
+    return question_ids
 
 
 @db.connection_handler
-def delete_comment(cursor, comment_id):
-    get_ids_query = """
-        SELECT question_id, answer_id FROM comment WHERE id = %(comment_id)s;
-    """
-    cursor.execute(get_ids_query, {'comment_id': comment_id})
-    result = cursor.fetchone()
-    question_id = result['question_id']
-    answer_id = result['answer_id']
-
-    if question_id:
-        delete_query = """
-            DELETE FROM comment WHERE id = %(comment_id)s AND question_id = %(question_id)s;
-        """
-        cursor.execute(delete_query, {'comment_id': comment_id, 'question_id': question_id})
-        return question_id
-    elif answer_id:
-        delete_query = """
-            DELETE FROM comment WHERE id = %(comment_id)s AND answer_id = %(answer_id)s;
-        """
-        cursor.execute(delete_query, {'comment_id': comment_id, 'answer_id': answer_id})
-        return answer_id
-    else:
-        return None
+def delete_questions(cursor, ids=None, submitted_before=None, max_vote_number=None):
+    cursor.execute(*delete_questions_query(ids, submitted_before, max_vote_number))
+    return questions_deleted(cursor.fetchall())
+
+
+DELETE_ANSWERS_QUERY = """
+    WITH doomed_questions AS (
+        SELECT id FROM question WHERE FALSE
+    ), doomed_answers AS (
+        SELECT id FROM answer WHERE {condition}
+    ), deleted_comments AS (
+        DELETE FROM comment WHERE answer_id IN (SELECT id FROM doomed_answers)
+    ), deleted AS (
+        DELETE FROM answer WHERE id IN (SELECT id FROM doomed_answers)
+        RETURNING id, question_id, image
+    )
+    SELECT deleted.id, deleted.question_id, {orphaned_image}
+    FROM deleted;
+"""
+
+
+def delete_answers_query(ids=None, submitted_before=None, max_vote_number=None):
+    condition, params = _moderation_filter('answer', ids, submitted_before, max_vote_number)
+    return DELETE_ANSWERS_QUERY.format(condition=condition, orphaned_image=ORPHANED_IMAGE), params
+
+
+def answers_deleted(deleted):
+    _remove_orphaned_images(deleted)
+    for question_id in {row['question_id'] for row in deleted}:
+        invalidate_question(question_id, listings=True)
+    for row in deleted:
+        invalidate_answer(row['id'])
+    return [{'id': row['id'], 'question_id': row['question_id']} for row in deleted]
+
+
+@db.connection_handler
+def delete_answers(cursor, ids=None, submitted_before=None, max_vote_number=None):
+    cursor.execute(*delete_answers_query(ids, submitted_before, max_vote_number))
+    return answers_deleted(cursor.fetchall())
+
+
+DELETE_COMMENTS_QUERY = """
+    WITH deleted AS (
+        DELETE FROM comment WHERE {condition}
+        RETURNING id, question_id, answer_id
+    )
+    SELECT deleted.id, deleted.answer_id, COALESCE(deleted.question_id, answer.question_id) AS question_id
+    FROM deleted
+    LEFT JOIN answer ON answer.id = deleted.answer_id;
+"""
+
+
+def delete_comments_query(ids=None, submitted_before=None):
+    condition, params = _moderation_filter('comment', ids, submitted_before)
+    return DELETE_COMMENTS_QUERY.format(condition=condition), params
+
+
+def comments_deleted(deleted):
+    for question_id in {row['question_id'] for row in deleted}:
+        invalidate_question(question_id, listings=True)
+    for answer_id in {row['answer_id'] for row in deleted if row['answer_id'] is not None}:
+        invalidate_answer(answer_id)
+    return deleted
+
+
+@db.connection_handler
+def delete_comments(cursor, ids=None, submitted_before=None):
+    cursor.execute(*delete_comments_query(ids, submitted_before))
+    return comments_deleted(cursor.fetchall())
+
+
+def delete_question(question_id):
+    delete_questions([question_id])
+
+
+def delete_answer(answer_id):
+    deleted = delete_answers([answer_id])
+    return deleted[0]['question_id'] if deleted else None
+
+
+def delete_comment(comment_id):
+    deleted = delete_comments([comment_id])
+    return deleted[0]['question_id'] if deleted else None
+
+
+EDIT_QUESTION_QUERY = """
+    UPDATE question
+    SET title = %(title)s, message = %(message)s
+    WHERE id = %(question_id)s;
+"""
 
 
 @db.connection_handler
 def edit_question(cursor, question_id, title, message):
-    query = """
+    cursor.execute(EDIT_QUESTION_QUERY, {'title': title, 'message': message, 'question_id': question_id})
+    invalidate_question(question_id, listings=True)
+
+
+# ledger upsert and counter update in one statement; the counter can never go below zero.
+# The delta comes from the upserted row itself, not from a read of the statement's snapshot, which a concurrent
+# vote of the same user may already have changed: a row is only updated when its value flips between -1 and 1,
+# so an update moves the counter by twice the new value and an insert (xmax = 0 on a fresh row) by the value.
+CAST_VOTE_QUERY = """
+    WITH cast_vote AS (
+        INSERT INTO vote (user_id, {table}_id, value)
+        VALUES (%(user_id)s, %(item_id)s, %(value)s)
+        ON CONFLICT (user_id, {table}_id) WHERE {table}_id IS NOT NULL
+        DO UPDATE SET value = EXCLUDED.value
+        WHERE vote.value <> EXCLUDED.value
+        RETURNING value, xmax = 0 AS inserted
+    ), change AS (
+        SELECT CASE WHEN cast_vote.inserted THEN cast_vote.value ELSE 2 * cast_vote.value END AS delta
+        FROM cast_vote
+    ), counter AS (
+        UPDATE {table}
+        SET vote_number = GREATEST(vote_number + change.delta, 0)
+        FROM change
+        WHERE {table}.id = %(item_id)s AND %(apply_counter)s::boolean
+        RETURNING vote_number
+    )
+    SELECT COALESCE((SELECT delta FROM change), 0) AS delta, {question_id} AS question_id;
+"""
+# table names come from VOTABLE_TABLES only, so they are formatted in once here
+CAST_VOTE_QUERIES = {
+    'question': CAST_VOTE_QUERY.format(table='question', question_id='%(item_id)s'),
+    'answer': CAST_VOTE_QUERY.format(table='answer',
+                                     question_id='(SELECT question_id FROM answer WHERE id = %(item_id)s)'),
+}
+
+
+def cast_vote_params(table, item_id, user_id, value, apply_counter):
+    if table not in VOTABLE_TABLES:
+        raise ValueError(f'Unsupported table: {table}')
+    return {'user_id': int(user_id), 'item_id': int(item_id), 'value': value, 'apply_counter': apply_counter}
+
+
+def vote_cast(table, item_id, result, apply_counter):
+    if result['delta'] and apply_counter and result['question_id'] is not None:
+        invalidate_question(result['question_id'], listings=table == 'question')
+        if table == 'answer':
+            invalidate_answer(item_id)
+    return result['delta']
+
+
+@db.connection_handler
+def cast_vote(cursor, table, item_id, user_id, value, apply_counter=True):
+    params = cast_vote_params(table, item_id, user_id, value, apply_counter)
+    cursor.execute_prepared(f'cast_vote_{table}', CAST_VOTE_QUERIES[table], params)
+    return vote_cast(table, item_id, cursor.fetchone(), apply_counter)
+
+
+# both counters change in one statement, so a failed flush leaves none of the batch applied and can be retried whole
+FLUSH_VOTE_COUNTERS_QUERY = """
+    WITH question_votes AS (
         UPDATE question
-        SET title = %(title)s, message = %(message)s
-        WHERE id = %(question_id)s;
-    """
-    cursor.execute(query, {'title': title, 'message': message, 'question_id': question_id})
-
-
-@db.connection_handler
-def vote_question(cursor, question_id, vote_type):
-    query_1 = "SELECT vote_number FROM question WHERE id=%(question_id)s"
-    cursor.execute(query_1, {'question_id': question_id})
-    vote_number = cursor.fetchone()['vote_number']
-    if vote_type == 'up':
-        query_2 = """
-                UPDATE question
-                SET vote_number = vote_number + %(vote)s
-                WHERE id=%(question_id)s;
-                """
-        cursor.execute(query_2, {'question_id': question_id, 'vote': 1})
-    elif vote_type == 'down' and vote_number > 0:
-        query_2 = """
-                UPDATE question
-                SET vote_number = vote_number + %(vote)s
-                WHERE id=%(question_id)s;
-                """
-        cursor.execute(query_2, {'question_id': question_id, 'vote': -1})
-
-
-@db.connection_handler
-def update_question_views(cursor, question_id):
-    query = """UPDATE question 
-        SET view_number = view_number + 1
-        WHERE id=%s 
-    """
-    cursor.execute(query, (question_id,))
+        SET vote_number = GREATEST(vote_number + votes.delta, 0)
+        FROM (SELECT unnest(%(question_ids)s::integer[]) AS id,
+                     unnest(%(question_deltas)s::integer[]) AS delta) AS votes
+        WHERE question.id = votes.id
+        RETURNING 'question' AS item_table, question.id, question.id AS question_id
+    ), answer_votes AS (
+        UPDATE answer
+        SET vote_number = GREATEST(vote_number + votes.delta, 0)
+        FROM (SELECT unnest(%(answer_ids)s::integer[]) AS id,
+                     unnest(%(answer_deltas)s::integer[]) AS delta) AS votes
+        WHERE answer.id = votes.id
+        RETURNING 'answer' AS item_table, answer.id, answer.question_id
+    )
+    SELECT * FROM question_votes
+    UNION ALL
+    SELECT * FROM answer_votes;
+"""
+
+
+def vote_counters_params(increments):
+    params = {}
+    for table in VOTABLE_TABLES:
+        changes = [(item_id, delta) for (item_table, item_id), delta in increments if item_table == table and delta]
+        params[f'{table}_ids'] = [item_id for item_id, _ in changes]
+        params[f'{table}_deltas'] = [delta for _, delta in changes]
+    return params
+
+
+def vote_counters_flushed(updated):
+    for row in updated:
+        invalidate_question(row['question_id'])
+        if row['item_table'] == 'answer':
+            invalidate_answer(row['id'])
+    if any(row['item_table'] == 'question' for row in updated):
+        invalidate_listings()
 
 
 @db.connection_handler
-def get_all_questions_ordered(cursor, order_by, order_direction):
-    query = f"""
-        SELECT * FROM question
-        ORDER BY {order_by} {order_direction}
-    """
-    cursor.execute(query)
-    return cursor.fetchall()
+def flush_vote_counters(cursor, increments):
+    cursor.execute_prepared('flush_vote_counters', FLUSH_VOTE_COUNTERS_QUERY, vote_counters_params(increments))
+    vote_counters_flushed(cursor.fetchall())
+
+
+vote_counters = counter_buffer.CounterBuffer(flush_vote_counters, VOTE_FLUSH_INTERVAL, VOTE_FLUSH_THRESHOLD)
+hot_votes = counter_buffer.RateTracker(HOT_VOTE_WINDOW, HOT_VOTE_THRESHOLD)
+
+
+def vote(table, item_id, user_id, vote_type):
+    hot = hot_votes.hit((table, item_id))
+    # on hot items only the ledger row is written now; the counter change is batched with the other votes
+    delta = cast_vote(table, item_id, user_id, VOTE_VALUES[vote_type], apply_counter=not hot)
+    if hot and delta:
+        vote_counters.add((table, item_id), delta)
+    return delta
+
+
+FLUSH_QUESTION_VIEWS_QUERY = """
+    UPDATE question
+    SET view_number = view_number + views.count
+    FROM (SELECT unnest(%(ids)s::integer[]) AS id, unnest(%(counts)s::integer[]) AS count) AS views
+    WHERE question.id = views.id;
+"""
+
+
+def question_views_params(increments):
+    return {'ids': [question_id for question_id, _ in increments], 'counts': [count for _, count in increments]}
 
 
 @db.connection_handler
-def get_latest_questions(cursor, number):
-    query = f"""
-        SELECT * FROM question
-        ORDER BY submission_time DESC
-        LIMIT %(number)s
-    """
-    cursor.execute(query, {'number': number})
+def flush_question_views(cursor, increments):
+    cursor.execute_prepared('flush_question_views', FLUSH_QUESTION_VIEWS_QUERY, question_views_params(increments))
+
+
+view_counter = counter_buffer.CounterBuffer(flush_question_views, VIEW_FLUSH_INTERVAL, VIEW_FLUSH_THRESHOLD)
+
+
+def update_question_views(question_id):
+    view_counter.add(question_id)
+
+
+def encode_page_cursor(question, order_by, backwards=False):
+    key = [question[order_by], question['id'], backwards]
+    return base64.urlsafe_b64encode(json.dumps(key, default=str).encode()).decode()
+
+
+def decode_page_cursor(page_cursor):
+    try:
+        value, question_id, backwards = json.loads(base64.urlsafe_b64decode(page_cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid page cursor')
+    return value, question_id, bool(backwards)
+
+
+QUESTIONS_PAGE_SEGMENT = """
+    (SELECT * FROM question
+     WHERE {condition}
+     ORDER BY {column} {direction}, id {direction}
+     LIMIT %(limit)s)
+"""
+# each segment is already ordered and limited, so the outer sort only ever sees a couple of pages of rows
+QUESTIONS_PAGE_QUERY = """
+    SELECT * FROM ({segments}) AS page
+    ORDER BY {column} {direction}, id {direction}
+    LIMIT %(limit)s;
+"""
+
+
+def questions_page_query(order_by, order_direction, page_cursor=None, per_page=QUESTIONS_PER_PAGE, tag_id=None):
+    if order_by not in QUESTION_SORT_KEYS or order_direction not in ('asc', 'desc'):
+        raise ValueError(f'Unsupported sort order: {order_by} {order_direction}')
+    backwards = False
+    descending = order_direction == 'desc'
+    params = {'limit': per_page + 1}
+    # order_by is one of the whitelisted sort keys, so it is safe to format in
+    column = f'"{order_by}"'
+    # Postgres sorts NULLs last going up and first going down; a keyset comparison never matches them,
+    # so the rows past the cursor are read as up to two index-ordered segments, NULLs apart
+    segments = ['TRUE']
+    shape = 'first'
+    if page_cursor is not None:
+        value, question_id, backwards = decode_page_cursor(page_cursor)
+        params['question_id'] = question_id
+        # walking back to the previous page scans the same index in the opposite direction
+        scan_descending = descending != backwards
+        if value is None:
+            shape = 'after_null'
+            segments = [f'{column} IS NULL AND id {"<" if scan_descending else ">"} %(question_id)s']
+            if scan_descending:
+                segments.append(f'{column} IS NOT NULL')
+        else:
+            shape = 'after_value'
+            params['value'] = str(value)
+            segments = [f'({column}, id) {"<" if scan_descending else ">"} '
+                        f'(CAST(%(value)s::text AS {SORT_COLUMN_TYPES[order_by]}), %(question_id)s)']
+            if not scan_descending:
+                segments.append(f'{column} IS NULL')
+    if tag_id is not None:
+        segments = [f'{segment} AND id IN (SELECT question_id FROM question_tag WHERE tag_id = %(tag_id)s)'
+                    for segment in segments]
+        params['tag_id'] = tag_id
+        shape += '_tagged'
+    direction = 'DESC' if descending != backwards else 'ASC'
+    # one prepared statement per query shape, at most 72 of them
+    name = f'get_questions_page_{order_by}_{direction.lower()}_{shape}'
+    query = QUESTIONS_PAGE_QUERY.format(
+        segments='UNION ALL'.join(QUESTIONS_PAGE_SEGMENT.format(condition=segment, column=column, direction=direction)
+                                  for segment in segments),
+        column=column, direction=direction)
+    return name, query, params, backwards
+
+
+def questions_page(questions, order_by, page_cursor, per_page, backwards):
+    has_more = len(questions) > per_page
+    questions = questions[:per_page]
+    if backwards:
+        questions.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, page_cursor is not None
+    return {
+        'questions': questions,
+        'next_cursor': encode_page_cursor(questions[-1], order_by) if questions and has_next else None,
+        'prev_cursor': encode_page_cursor(questions[0], order_by, backwards=True) if questions and has_prev else None,
+    }
+
+
+@cache.cached('questions_page', QUESTIONS_PAGE_TTL)
+@db.connection_handler
+def get_questions_page(cursor, order_by, order_direction, page_cursor=None, per_page=QUESTIONS_PER_PAGE, tag_id=None,
+                       listing_version=None):
+    # listing_version only keys the cache: a page cached before a write never answers for the version after it
+    name, query, params, backwards = questions_page_query(order_by, order_direction, page_cursor, per_page, tag_id)
+    cursor.execute_prepared(name, query, params)
+    return questions_page(cursor.fetchall(), order_by, page_cursor, per_page, backwards)
+
+
+LATEST_QUESTIONS_QUERY = """
+    SELECT * FROM question
+    ORDER BY submission_time DESC
+    LIMIT %(number)s;
+"""
+
+
+@cache.cached('latest_questions', LATEST_QUESTIONS_TTL)
+@db.connection_handler
+def get_latest_questions(cursor, number, listing_version=None):
+    cursor.execute_prepared('get_latest_questions', LATEST_QUESTIONS_QUERY, {'number': number})
     return cursor.fetchall()
 
 
+IMAGE_BY_QUESTION_QUERY = """
+    SELECT image FROM question
+    WHERE id = %(question_id)s;
+"""
+
+
 @db.connection_handler
 def get_image_link_by_question_id(cursor, question_id):
-    query = """
-        SELECT image FROM question
-        WHERE id=%s;
-    """
-    cursor.execute(query, (question_id,))
+    cursor.execute(IMAGE_BY_QUESTION_QUERY, {'question_id': question_id})
     return cursor.fetchone()
 
 
+SEARCH_QUERY = """
+    WITH search AS (
+        SELECT websearch_to_tsquery('english', %(search_phrase)s) AS query,
+               websearch_to_tsquery('english', %(highlight_phrase)s) AS highlight
+    ), question_hits AS (
+        SELECT question.id AS question_id, ts_rank(question.search_vector, search.query) AS rank
+        FROM question, search
+        WHERE question.search_vector @@ search.query
+    ), answer_hits AS (
+        SELECT answer.question_id, answer.id, answer.message,
+               ts_rank(answer.search_vector, search.query) AS rank
+        FROM answer, search
+        WHERE answer.search_vector @@ search.query
+    ), ranked AS (
+        SELECT hits.question_id, MAX(hits.rank) AS rank
+        FROM (SELECT question_id, rank FROM question_hits
+              UNION ALL
+              SELECT question_id, rank FROM answer_hits) AS hits
+        GROUP BY hits.question_id
+    ), results_page AS (
+        SELECT question.id, question.title, question.message, question.submission_time,
+               ranked.rank, COUNT(*) OVER () AS total_results
+        FROM ranked
+        JOIN question ON question.id = ranked.question_id
+        ORDER BY ranked.rank DESC, question.id DESC
+        LIMIT %(limit)s OFFSET %(offset)s
+    )
+    SELECT results_page.*,
+        ts_headline('english', results_page.title, search.highlight, %(title_headline)s) AS title_headline,
+        ts_headline('english', results_page.message, search.highlight, %(message_headline)s) AS message_headline,
+        EXISTS (SELECT 1 FROM answer_hits
+                WHERE answer_hits.question_id = results_page.id) AS matched_in_answer,
+        (SELECT COALESCE(jsonb_agg(jsonb_build_object(
+                             'id', top.id, 'message', top.message,
+                             'headline', ts_headline('english', top.message, search.highlight, %(message_headline)s))
+                         ORDER BY top.rank DESC), '[]'::jsonb)
+         FROM (SELECT id, message, rank FROM answer_hits
+               WHERE answer_hits.question_id = results_page.id
+               ORDER BY rank DESC
+               LIMIT %(answers_per_result)s) AS top) AS answers
+    FROM results_page, search
+    ORDER BY results_page.rank DESC, results_page.id DESC;
+"""
+
+
+def search_params(search_phrase, page, per_page):
+    return {'search_phrase': search_phrase,
+            'highlight_phrase': util.highlight_phrase(search_phrase),
+            'limit': per_page,
+            'offset': (page - 1) * per_page,
+            'answers_per_result': SEARCH_ANSWERS_PER_RESULT,
+            'title_headline': SEARCH_HEADLINE_OPTIONS + ', HighlightAll=true',
+            'message_headline': SEARCH_HEADLINE_OPTIONS + f', MinWords={SEARCH_HEADLINE_WORDS // 2}, '
+                                                          f'MaxWords={SEARCH_HEADLINE_WORDS}'}
+
+
+def search_page(results, page, per_page):
+    return {
+        'results': results,
+        'total': results[0]['total_results'] if results else 0,
+        'page': page,
+        'per_page': per_page,
+    }
+
+
 @db.connection_handler
-def search_results(cursor, search_phrase):
-    query = f"""
-        SELECT DISTINCT question.* FROM question
-        LEFT JOIN answer ON question.id = answer.question_id
-        WHERE question.title ILIKE '%%{search_phrase}%%'
-        OR question.message ILIKE '%%{search_phrase}%%'
-        OR answer.message ILIKE '%%{search_phrase}%%'
-    """
-    cursor.execute(query)
-    return cursor.fetchall()
+def search_results(cursor, search_phrase, page=1, per_page=SEARCH_RESULTS_PER_PAGE):
+    cursor.execute(SEARCH_QUERY, search_params(search_phrase, page, per_page))
+    return search_page(cursor.fetchall(), page, per_page)
 
 
 @db.connection_handler
-def get_answer_by_id(cursor, answer_id):
-    query = """
-        SELECT * FROM answer
-        WHERE id = %(answer_id)s;
-    """
-    cursor.execute(query, {'answer_id': answer_id})
-    return cursor.fetchone()
+def reindex_search(cursor, table, after_id=0, batch_size=1000, full=False):
+    if table not in SEARCHABLE_TABLES:
+        raise ValueError(f'Unsupported table: {table}')
+    # touching the indexed columns fires the search_vector trigger; without `full` only unindexed rows are visited
+    columns = 'title = title, message = message' if table == 'question' else 'message = message'
+    query = sql.SQL("""
+        UPDATE {table} SET {columns}
+        WHERE id IN (SELECT id FROM {table}
+                     WHERE id > %(after_id)s {only_missing}
+                     ORDER BY id
+                     LIMIT %(batch_size)s)
+        RETURNING id;
+    """).format(table=sql.Identifier(table),
+                columns=sql.SQL(columns),
+                only_missing=sql.SQL('' if full else 'AND search_vector IS NULL'))
+    cursor.execute(query, {'after_id': after_id, 'batch_size': batch_size})
+    ids = [row['id'] for row in cursor.fetchall()]
+    return len(ids), max(ids, default=after_id)
 
 
 @db.connection_handler
-def edit_answer(cursor, answer_id, message):
-    submission_time = util.get_current_timestamp()
+def repair_question_activity(cursor, after_id=0, batch_size=1000):
+    # recomputes answer_count, comment_count and last_activity_at for a batch of questions
     query = """
-        UPDATE answer
-        SET message = %(message)s, submission_time = %(submission_time)s
-        WHERE id = %(answer_id)s;
+        SELECT id FROM question
+        WHERE id > %(after_id)s
+        ORDER BY id
+        LIMIT %(batch_size)s;
     """
-    cursor.execute(query, {'message': message, 'answer_id': answer_id, 'submission_time': submission_time})
+    cursor.execute(query, {'after_id': after_id, 'batch_size': batch_size})
+    ids = [row['id'] for row in cursor.fetchall()]
+    if not ids:
+        return 0, 0, after_id
+    cursor.execute('SELECT refresh_question_activity(%(ids)s) AS repaired;', {'ids': ids})
+    repaired = cursor.fetchone()['repaired']
+    if repaired:
+        invalidate_listings()
+        for question_id in ids:
+            invalidate_question(question_id)
+    return len(ids), repaired, ids[-1]
+
+
+ANSWER_BY_ID_QUERY = """
+    SELECT * FROM answer
+    WHERE id = %(answer_id)s;
+"""
 
 
 @db.connection_handler
-def get_question_id_by_answer(cursor, answer_id):
-    query = """
-            SELECT question_id FROM answer
-            WHERE id = %(answer_id)s;
-    """
-    cursor.execute(query, {'answer_id': answer_id})
+def get_answer_by_id(cursor, answer_id):
+    cursor.execute_prepared('get_answer_by_id', ANSWER_BY_ID_QUERY, {'answer_id': answer_id})
     return cursor.fetchone()
 
 
+# an edited answer counts as new, so it moves back to the top of the question page
+EDIT_ANSWER_QUERY = """
+    UPDATE answer
+    SET message = %(message)s, submission_time = LOCALTIMESTAMP(0)
+    WHERE id = %(answer_id)s
+    RETURNING question_id;
+"""
+
+
+def answer_edited(answer_id, question_id):
+    if question_id is not None:
+        invalidate_question(question_id, listings=True)
+        invalidate_answer(answer_id)
+    return question_id
+
+
 @db.connection_handler
-def get_question_tags(cursor, question_id):
-    query = """
-            SELECT question_id, tag_id, name
-            FROM question_tag
-            LEFT JOIN tag
-            ON question_tag.tag_id = tag.id
-            WHERE question_id = %(question_id)s;
-    """
-    cursor.execute(query, {'question_id': question_id})
-    return cursor.fetchall()
+def edit_answer(cursor, answer_id, message):
+    cursor.execute(EDIT_ANSWER_QUERY, {'message': message, 'answer_id': answer_id})
+    answer = cursor.fetchone()
+    return answer_edited(answer_id, answer['question_id'] if answer is not None else None)
+
+
+QUESTION_ID_BY_ANSWER_QUERY = """
+    SELECT question_id FROM answer
+    WHERE id = %(answer_id)s;
+"""
+
+
+@db.connection_handler
+def get_question_id_by_answer(cursor, answer_id):
+    cursor.execute_prepared('get_question_id_by_answer', QUESTION_ID_BY_ANSWER_QUERY, {'answer_id': answer_id})
+    return cursor.fetchone()
 
 
 @db.connection_handler
 def get_question_id_by_answer_id(cursor, answer_id):
-    query = """
-        SELECT question_id FROM answer WHERE id = %(answer_id)s;
-    """
-    cursor.execute(query, {'answer_id': answer_id})
+    cursor.execute_prepared('get_question_id_by_answer', QUESTION_ID_BY_ANSWER_QUERY, {'answer_id': answer_id})
     result = cursor.fetchone()
     if result:
         return result['question_id']
@@ -283,188 +809,206 @@ def get_question_id_by_answer_id(cursor, answer_id):
         return None
 
 
+TAGS_QUERY = """
+    SELECT id, name FROM tag
+    ORDER BY id;
+"""
+
+
 @db.connection_handler
-def get_existing_tags(cursor):
-    query = """
-            SELECT * FROM tag
-            ORDER BY id;
-    """
-    cursor.execute(query)
+def load_tags(cursor):
+    cursor.execute(TAGS_QUERY)
     return cursor.fetchall()
 
 
-@db.connection_handler
-def check_for_tag(cursor, tag_name):
-    query = """
-            SELECT CASE WHEN EXISTS (SELECT * FROM tag
-                         WHERE name = %(tag_name)s)
-            THEN (SELECT id FROM tag
-                  WHERE name = %(tag_name)s)
-            ELSE CAST (0 AS INTEGER) END;
-    """
-    cursor.execute(query, {'tag_name': tag_name})
-    tag_result = cursor.fetchone()
-    return tag_result['case']
+tags = tag_dictionary.TagDictionary(TAG_DICTIONARY_MAX_AGE)
 
 
-@db.connection_handler
-def is_tag_already_added(cursor, tag_id, question_id):
-    query = """
-            SELECT CASE WHEN EXISTS (SELECT * FROM question_tag
-                WHERE tag_id = %(tag_id)s AND question_id = %(question_id)s)
-            THEN CAST (1 AS INTEGER)
-            ELSE CAST (0 AS INTEGER) END;
-        """
-    cursor.execute(query, {'question_id': question_id, 'tag_id': tag_id})
-    result = cursor.fetchone()
-    return result['case']
+def warm_tag_dictionary():
+    tags.load(load_tags())
+
+
+def get_existing_tags():
+    if tags.is_stale():
+        warm_tag_dictionary()
+    return tags.all()
+
+
+ADD_TAGS_QUERY = """
+    INSERT INTO question_tag (question_id, tag_id)
+    SELECT %(question_id)s, unnest(%(tag_ids)s::integer[])
+    ON CONFLICT DO NOTHING;
+"""
 
 
 @db.connection_handler
-def add_tag(cursor, tag_id, question_id):
-    if is_tag_already_added(tag_id, question_id) == 1:
+def add_tags(cursor, question_id, tag_ids):
+    tag_ids = sorted({int(tag_id) for tag_id in tag_ids})
+    if not tag_ids:
         return
-    query = """
-            INSERT INTO question_tag (question_id, tag_id)
-            VALUES (%(question_id)s, %(tag_id)s);
-    """
-    cursor.execute(query, {'question_id': question_id, 'tag_id': tag_id})
+    cursor.execute(ADD_TAGS_QUERY, {'question_id': int(question_id), 'tag_ids': tag_ids})
+    invalidate_tagging(question_id)
 
 
-@db.connection_handler
-def add_new_tag(cursor, tag_name):
-    tag_id = check_for_tag(tag_name)
-    if tag_id != 0:
-        return tag_id
+def add_tag(tag_id, question_id):
+    add_tags(question_id, [tag_id])
 
-    query = """
-            INSERT INTO tag (name)
-            VALUES (%(name)s);
-    """
-    cursor.execute(query, {'name': tag_name})
 
-    query = """
-            SELECT id FROM tag
-            WHERE name = %(name)s;
-       """
-    cursor.execute(query, {'name': tag_name})
-    tag_id = cursor.fetchone()
-    return tag_id['id']
+# DO UPDATE (not DO NOTHING) so RETURNING also yields the ids of tags that already existed
+UPSERT_TAGS_QUERY = """
+    INSERT INTO tag (name)
+    SELECT unnest(%(names)s::text[])
+    ON CONFLICT (name) DO UPDATE SET name = EXCLUDED.name
+    RETURNING id, name;
+"""
+
+
+def tags_upserted(created):
+    db.on_commit(lambda: [tags.add(tag['id'], tag['name']) for tag in created])
+    return {tag['name']: tag['id'] for tag in created}
 
 
 @db.connection_handler
-def add_comment_to_answer(cursor, answer_id, message):
-    submission_time = util.get_current_timestamp()
-    query_1 = """
-        INSERT INTO comment (answer_id, message, submission_time)
-        VALUES (%(answer_id)s, %(message)s, %(submission_time)s)
-        """
-    cursor.execute(query_1, {'answer_id': answer_id, 'message': message, 'submission_time': submission_time})
-    query_2 = """
-        SELECT question_id FROM answer
-        WHERE id=%(answer_id)s;
-    """
-    cursor.execute(query_2, {'answer_id': answer_id})
-    return cursor.fetchone()['question_id']
+def upsert_tags(cursor, tag_names):
+    cursor.execute(UPSERT_TAGS_QUERY, {'names': list(tag_names)})
+    return tags_upserted(cursor.fetchall())
+
+
+def add_new_tags(tag_names):
+    if tags.is_stale():
+        warm_tag_dictionary()
+    tag_names = list(dict.fromkeys(name.strip() for name in tag_names if name.strip()))
+    missing = [name for name in tag_names if tags.get_id(name) is None]
+    tag_ids = upsert_tags(missing) if missing else {}
+    return [tags.get_id(name) or tag_ids[name] for name in tag_names]
+
+
+def add_new_tag(tag_name):
+    tag_ids = add_new_tags([tag_name])
+    return tag_ids[0] if tag_ids else None
+
+
+TAG_ID_QUERY = """
+    SELECT id FROM tag
+    WHERE name = %(name)s;
+"""
 
 
 @db.connection_handler
-def get_comments_for_question(cursor, question_id):
-    query = """
-        SELECT * FROM comment
-        WHERE question_id=%s
-        ORDER BY submission_time DESC;
-    """
-    cursor.execute(query, (question_id,))
+def load_tag_id(cursor, tag_name):
+    cursor.execute_prepared('load_tag_id', TAG_ID_QUERY, {'name': tag_name})
+    tag = cursor.fetchone()
+    return tag['id'] if tag is not None else None
+
+
+def get_tag_id(tag_name):
+    if tags.is_stale():
+        warm_tag_dictionary()
+    tag_id = tags.get_id(tag_name)
+    if tag_id is None:
+        # another worker may have created it since the dictionary was loaded
+        tag_id = load_tag_id(tag_name)
+        if tag_id is not None:
+            tags.add(tag_id, tag_name)
+    return tag_id
+
+
+TAG_CLOUD_QUERY = """
+    SELECT tag.id, tag.name, tag_question_count.question_count
+    FROM tag_question_count
+    JOIN tag ON tag.id = tag_question_count.tag_id
+    WHERE tag_question_count.question_count > 0
+    ORDER BY tag_question_count.question_count DESC, tag.name
+    LIMIT %(size)s;
+"""
+
+
+@cache.cached('tag_cloud', TAG_CLOUD_TTL)
+@db.connection_handler
+def get_tag_cloud(cursor, size=TAG_CLOUD_SIZE):
+    cursor.execute(TAG_CLOUD_QUERY, {'size': size})
     return cursor.fetchall()
 
 
+ADD_ANSWER_COMMENT_QUERY = """
+    INSERT INTO comment (answer_id, message, submission_time)
+    VALUES (%(answer_id)s, %(message)s, LOCALTIMESTAMP(0))
+    RETURNING (SELECT question_id FROM answer WHERE id = %(answer_id)s) AS question_id;
+"""
+
+
+def answer_commented(answer_id, question_id):
+    invalidate_question(question_id, listings=True)
+    invalidate_answer(answer_id)
+    return question_id
+
+
 @db.connection_handler
-def get_comments_for_answers(cursor, question_id):
-    query_1 = """
-        SELECT id FROM answer
-        WHERE question_id=%s
-    """
-    cursor.execute(query_1, (question_id,))
-    id_list = tuple([x['id'] for x in cursor.fetchall()])
-    if len(id_list) == 0:
-        return None
-    else:
-        query_2 = """
-            SELECT * FROM comment
-            WHERE answer_id IN %(id_list)s
-            ORDER BY submission_time DESC;
-        """
-        cursor.execute(query_2, {'id_list': id_list})
-        return cursor.fetchall()
+def add_comment_to_answer(cursor, answer_id, message):
+    cursor.execute(ADD_ANSWER_COMMENT_QUERY, {'answer_id': answer_id, 'message': message})
+    return answer_commented(answer_id, cursor.fetchone()['question_id'])
+
+
+ADD_QUESTION_COMMENT_QUERY = """
+    INSERT INTO comment (question_id, message, submission_time)
+    VALUES (%(question_id)s, %(message)s, LOCALTIMESTAMP(0));
+"""
 
 
 @db.connection_handler
 def add_comment_to_question(cursor, question_id, message):
-    submission_time = util.get_current_timestamp()
-    query = """
-    INSERT INTO comment (question_id, message, submission_time)
-    VALUES (%(question_id)s, %(message)s, %(submission_time)s)
-    """
-    cursor.execute(query, {'question_id': question_id,
-                           'message': message,
-                           'submission_time': submission_time})
+    cursor.execute(ADD_QUESTION_COMMENT_QUERY, {'question_id': question_id, 'message': message})
+    invalidate_question(question_id, listings=True)
     return question_id
 
 
-@db.connection_handler
-def sort_questions(cursor, order_by, order_direction):
-    cursor.execute("SELECT * FROM question ORDER BY {} {}".format(order_by, order_direction))
-    return cursor.fetchall()
+DELETE_QUESTION_TAG_QUERY = """
+    DELETE FROM question_tag
+    WHERE question_id = %(question_id)s AND tag_id = %(tag_id)s;
+"""
 
 
 @db.connection_handler
 def delete_tag_from_question(cursor, question_id, tag_id):
-    query = """
-            DELETE FROM question_tag
-            WHERE question_id = %(question_id)s AND tag_id = %(tag_id)s
-    """
-    cursor.execute(query, {'question_id': question_id, 'tag_id': tag_id})
+    cursor.execute(DELETE_QUESTION_TAG_QUERY, {'question_id': question_id, 'tag_id': tag_id})
+    invalidate_tagging(question_id)
+
+
+COMMENT_BY_ID_QUERY = """
+    SELECT * FROM comment
+    WHERE id = %(comment_id)s;
+"""
 
 
 @db.connection_handler
 def get_comment_by_id(cursor, comment_id):
-    query = """
-            SELECT * FROM comment
-            WHERE id = %(comment_id)s
-    """
-    cursor.execute(query, {'comment_id': comment_id})
+    cursor.execute_prepared('get_comment_by_id', COMMENT_BY_ID_QUERY, {'comment_id': comment_id})
     return cursor.fetchone()
 
 
-@db.connection_handler
-def edit_comment(cursor, comment_id, message):
-    edited_count = get_edited_count(comment_id)
-    if edited_count['edited_count'] is None:
-        query = """
-                UPDATE comment
-                SET message = %(message)s, edited_count = 1
-                WHERE id = %(comment_id)s;
-        """
-        cursor.execute(query, {'message': message, 'comment_id': comment_id})
-    else:
-        ed_count = edited_count['edited_count'] + 1
-        query = """
-                        UPDATE comment
-                        SET message = %(message)s, edited_count = %(ed_count)s
-                        WHERE id = %(comment_id)s;
-                """
-        cursor.execute(query, {'message': message, 'comment_id': comment_id, 'ed_count': ed_count})
+EDIT_COMMENT_QUERY = """
+    UPDATE comment
+    SET message = %(message)s, edited_count = COALESCE(edited_count, 0) + 1
+    WHERE id = %(comment_id)s
+    RETURNING answer_id,
+              COALESCE(question_id,
+                       (SELECT question_id FROM answer WHERE answer.id = comment.answer_id)) AS question_id;
+"""
+
+
+def comment_edited(comment):
+    if comment is None:
+        return None
+    invalidate_question(comment['question_id'])
+    if comment['answer_id'] is not None:
+        invalidate_answer(comment['answer_id'])
+    return comment['question_id']
 
 
 @db.connection_handler
-def get_edited_count(cursor, comment_id):
-    query = """
-            SELECT edited_count FROM comment
-            WHERE id = %(comment_id)s
-    """
-    cursor.execute(query, {'comment_id': comment_id})
-    return cursor.fetchone()
+def edit_comment(cursor, comment_id, message):
+    cursor.execute(EDIT_COMMENT_QUERY, {'message': message, 'comment_id': comment_id})
+    return comment_edited(cursor.fetchone())
 
 
 @db.connection_handler
@@ -477,7 +1021,7 @@ def get_question_id_by_comment(cursor, comment_id):
             LEFT JOIN answer ON comment.answer_id = answer.id
             WHERE comment.id = %(comment_id)s;
     """
-    cursor.execute(query, {'comment_id': comment_id})
+    cursor.execute_prepared('get_question_id_by_comment', query, {'comment_id': comment_id})
     comment = cursor.fetchone()
     if comment['com_question_id']:
         return comment['com_question_id']
@@ -485,16 +1029,42 @@ def get_question_id_by_comment(cursor, comment_id):
         return comment['ans_question_id']
 
 
+# the hash is made by the caller (passwords.hash_password), before any connection is taken
+REGISTER_USER_QUERY = """
+    INSERT INTO users (email, password, registration_date)
+    VALUES (%(email)s, %(password)s, LOCALTIMESTAMP(0))
+    RETURNING id;
+"""
+
+
 @db.connection_handler
-def register_user(cursor, email, password):
-    password_hashed = bcrypt.hashpw(password.encode("UTF-8"), bcrypt.gensalt())
-    registration_date = util.get_current_timestamp()
-    user = {'email': email, 'password': password_hashed, 'registration_date': registration_date}
-    query = """
-            INSERT INTO users (email, password, registration_date)
-            VALUES (%(email)s, %(password)s, %(registration_date)s);
-            SELECT id FROM users
-            WHERE email = %(email)s;
-    """
-    cursor.execute(query, user)
+def register_user(cursor, email, password_hash):
+    cursor.execute(REGISTER_USER_QUERY, {'email': email, 'password': password_hash})
     return cursor.fetchone()['id']
+
+
+USER_CREDENTIALS_QUERY = """
+    SELECT id, password FROM users
+    WHERE email = %(email)s
+    ORDER BY id
+    LIMIT 1;
+"""
+
+
+@db.connection_handler
+def get_user_credentials(cursor, email):
+    cursor.execute_prepared('get_user_credentials', USER_CREDENTIALS_QUERY, {'email': email})
+    return cursor.fetchone()
+
+
+UPDATE_PASSWORD_HASH_QUERY = """
+    UPDATE users SET password = %(password)s
+    WHERE id = %(user_id)s;
+"""
+
+
+@db.connection_handler
+def update_password_hash(cursor, user_id, password_hash):
+    cursor.execute(UPDATE_PASSWORD_HASH_QUERY, {'password': password_hash, 'user_id': user_id})
+
+
@@ -0,0 +1,150 @@
+import atexit
+import hashlib
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import url_for
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+IMAGES_FOLDER = os.path.join(STATIC_FOLDER, 'images')
+MAX_IMAGE_BYTES = int(os.environ.get('MAX_IMAGE_BYTES', 5 * 1024 * 1024))
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+CHUNK_SIZE = 64 * 1024
+# mkstemp creates files readable by their owner only; the web server serving /static may run as someone else
+IMAGE_FILE_MODE = 0o644
+# variant name -> longest side in pixels
+VARIANTS = {'thumb': 150, 'web': 800}
+SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+)
+
+_executor = None
+
+
+class ImageRejected(ValueError):
+    pass
+
+
+def _detect_type(head):
+    for signature, extension in SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def save_upload(file_storage):
+    # the upload is hashed while it is copied, so it is read exactly once and never held in memory
+    digest = hashlib.sha256()
+    size = 0
+    extension = None
+    descriptor, temporary_path = tempfile.mkstemp(dir=IMAGES_FOLDER, prefix='.upload-')
+    try:
+        with os.fdopen(descriptor, 'wb') as temporary_file:
+            while True:
+                chunk = file_storage.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if extension is None:
+                    extension = _detect_type(chunk)
+                    if extension is None:
+                        raise ImageRejected('Only PNG, JPEG, GIF and WebP images can be uploaded')
+                size += len(chunk)
+                if size > MAX_IMAGE_BYTES:
+                    raise ImageRejected(f'Images can be at most {MAX_IMAGE_BYTES // (1024 * 1024)} MB')
+                digest.update(chunk)
+                temporary_file.write(chunk)
+        if size == 0:
+            raise ImageRejected('The uploaded image is empty')
+        name = f'{digest.hexdigest()}.{extension}'
+        path = os.path.join(IMAGES_FOLDER, name)
+        if os.path.exists(path):
+            # identical content is already stored under the same name
+            os.remove(temporary_path)
+        else:
+            os.chmod(temporary_path, IMAGE_FILE_MODE)
+            os.replace(temporary_path, path)
+            _submit_variants(path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    return f'images/{name}'
+
+
+def _variant_path(name, variant):
+    return os.path.join(IMAGES_FOLDER, variant, name)
+
+
+def make_variants(path):
+    # runs in a worker process; without Pillow installed the originals are simply served everywhere
+    try:
+        from PIL import Image
+    except ImportError:
+        return
+    name = os.path.basename(path)
+    for variant, size in VARIANTS.items():
+        target = _variant_path(name, variant)
+        if os.path.exists(target):
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with Image.open(path) as image:
+            image.thumbnail((size, size))
+            temporary_target = f'{target}.tmp'
+            image.save(temporary_target, format=image.format)
+        os.replace(temporary_target, target)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+        atexit.register(_executor.shutdown, wait=False)
+    return _executor
+
+
+def _submit_variants(path):
+    _get_executor().submit(make_variants, path)
+
+
+def image_filename(image, variant=None):
+    if not image or image == 'images/':
+        return None
+    if variant is not None:
+        name = os.path.basename(image)
+        # until the worker has finished (or for images stored before variants existed) serve the original
+        if os.path.exists(_variant_path(name, variant)):
+            return f'images/{variant}/{name}'
+    return image
+
+
+def image_url(image, variant=None):
+    filename = image_filename(image, variant)
+    return url_for('static', filename=filename) if filename else None
+
+
+def remove_images(paths):
+    for path in paths:
+        full_path = os.path.abspath(os.path.join(STATIC_FOLDER, path))
+        # never follow a stored path out of static/images
+        if os.path.dirname(full_path) != IMAGES_FOLDER or not os.path.isfile(full_path):
+            continue
+        name = os.path.basename(full_path)
+        for file_path in [full_path] + [_variant_path(name, variant) for variant in VARIANTS]:
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+
+
+def build_missing_variants():
+    names = [name for name in os.listdir(IMAGES_FOLDER)
+             if os.path.isfile(os.path.join(IMAGES_FOLDER, name)) and not name.startswith('.')]
+    with ProcessPoolExecutor(max_workers=IMAGE_WORKERS) as executor:
+        list(executor.map(make_variants, [os.path.join(IMAGES_FOLDER, name) for name in names]))
+    return len(names)
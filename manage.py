@@ -0,0 +1,184 @@
+import argparse
+import glob
+import os
+import sys
+
+import assets
+import bulk_io
+import data_manager as dm
+import image_store
+import migrations
+import plan_check
+import profiler
+
+
+def reindex_search(args):
+    for table in dm.SEARCHABLE_TABLES:
+        after_id = 0
+        total = 0
+        while True:
+            count, after_id = dm.reindex_search(table, after_id, args.batch_size, args.full)
+            if count == 0:
+                break
+            total += count
+            print(f'{table}: {total} rows reindexed (last id {after_id})')
+        print(f'{table}: done, {total} rows reindexed')
+
+
+def repair(args):
+    after_id = 0
+    checked = repaired = 0
+    while True:
+        count, fixed, after_id = dm.repair_question_activity(after_id, args.batch_size)
+        if count == 0:
+            break
+        checked += count
+        repaired += fixed
+        print(f'question: {checked} rows checked, {repaired} repaired (last id {after_id})')
+    print(f'question: done, {repaired} of {checked} rows repaired')
+
+
+def moderate(args):
+    filters = {'ids': args.ids, 'submitted_before': args.submitted_before}
+    if args.table == 'question':
+        deleted = dm.delete_questions(max_vote_number=args.max_votes, **filters)
+    elif args.table == 'answer':
+        deleted = dm.delete_answers(max_vote_number=args.max_votes, **filters)
+    else:
+        deleted = dm.delete_comments(**filters)
+    print(f'{len(deleted)} {args.table} rows deleted')
+
+
+def build_thumbnails(args):
+    count = image_store.build_missing_variants()
+    print(f'{count} images checked')
+
+
+def build_assets(args):
+    manifest = assets.build()
+    for name, fingerprinted in manifest.items():
+        print(f'{name} -> dist/{fingerprinted}')
+
+
+def hot_stacks(args):
+    for path in sorted(glob.glob(os.path.join(args.folder, '*.folded'))):
+        stacks = profiler.read_folded(path)
+        total = sum(stacks.values())
+        print(f'{os.path.basename(path)[:-len(".folded")]}: {total} samples')
+        for frame, own, inclusive in profiler.hot_frames(stacks, args.limit):
+            print(f'  {own / total:6.1%} self {inclusive / total:6.1%} total  {frame}')
+
+
+def export_data(args):
+    for table, count in bulk_io.export_data(args.folder, args.format, args.tables):
+        print(f'{table}: {count} rows exported')
+
+
+def import_data(args):
+    try:
+        for table, rows_done in bulk_io.import_data(args.folder, args.tables, args.batch_size, args.truncate):
+            print(f'{table}: {rows_done} rows imported')
+    except ValueError as error:
+        sys.exit(str(error))
+
+
+def migrate(args):
+    applied = 0
+    try:
+        for migration in migrations.migrate(target=args.target):
+            applied += 1
+            print(f'applied {migration.version}_{migration.name}')
+    except ValueError as error:
+        sys.exit(str(error))
+    print(f'{applied} migrations applied')
+
+
+def migration_status(args):
+    for migration, state in migrations.status():
+        print(f'{migration.version}_{migration.name}: {state}')
+
+
+def check_plans(args):
+    large_tables, results, unchecked = plan_check.check_plans(args.large_table_rows, not args.no_analyze)
+    print(f'large tables: {", ".join(sorted(large_tables)) or "none"}')
+    failures = 0
+    for label, statement, plan, offending in results:
+        if offending:
+            failures += 1
+            print(f'FAIL {label}: sequential scan on {", ".join(offending)}')
+            print(f'  {" ".join(statement.split())[:300]}')
+            for line in plan_check.describe(plan):
+                print(f'    {line}')
+        elif args.verbose:
+            print(f'ok   {label}')
+    for name in unchecked:
+        print(f'note: {name} has no plan check')
+    print(f'{len(results)} statements explained, {failures} with sequential scans on large tables')
+    if failures:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='AskMate maintenance commands')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    reindex = commands.add_parser('reindex-search', help='fill in missing full-text search vectors')
+    reindex.add_argument('--batch-size', type=int, default=1000)
+    reindex.add_argument('--full', action='store_true', help='rebuild every row, not only unindexed ones')
+    reindex.set_defaults(handler=reindex_search)
+
+    repairing = commands.add_parser('repair', help='recompute answer/comment counts and last activity of questions')
+    repairing.add_argument('--batch-size', type=int, default=1000)
+    repairing.set_defaults(handler=repair)
+
+    moderation = commands.add_parser('moderate', help='bulk delete questions, answers or comments')
+    moderation.add_argument('table', choices=dm.MODERATION_TABLES)
+    moderation.add_argument('--ids', type=int, nargs='+')
+    moderation.add_argument('--submitted-before', help='e.g. 2023-01-01')
+    moderation.add_argument('--max-votes', type=int, help='only rows with at most this many votes')
+    moderation.set_defaults(handler=moderate)
+
+    thumbnails = commands.add_parser('build-thumbnails', help='create missing thumbnail and web-size image variants')
+    thumbnails.set_defaults(handler=build_thumbnails)
+
+    static_assets = commands.add_parser('build-assets', help='fingerprint and precompress static assets')
+    static_assets.set_defaults(handler=build_assets)
+
+    exporting = commands.add_parser('export-data', help='dump all tables to CSV or JSONL files with COPY')
+    exporting.add_argument('folder')
+    exporting.add_argument('--format', choices=bulk_io.FORMATS, default='csv')
+    exporting.add_argument('--tables', nargs='+', choices=bulk_io.TABLES, default=bulk_io.TABLES)
+    exporting.set_defaults(handler=export_data)
+
+    importing = commands.add_parser('import-data', help='load files written by export-data; rerun to resume')
+    importing.add_argument('folder')
+    importing.add_argument('--tables', nargs='+', choices=bulk_io.TABLES, default=bulk_io.TABLES)
+    importing.add_argument('--batch-size', type=int, default=bulk_io.BATCH_SIZE, help='rows per transaction')
+    importing.add_argument('--truncate', action='store_true', help='empty the tables and start over')
+    importing.set_defaults(handler=import_data)
+
+    migration = commands.add_parser('migrate', help='apply the pending sql/ migrations in order')
+    migration.add_argument('--target', help='stop after this version, e.g. 010')
+    migration.set_defaults(handler=migrate)
+
+    migration_list = commands.add_parser('migration-status', help='list sql/ migrations and whether they are applied')
+    migration_list.set_defaults(handler=migration_status)
+
+    plans = commands.add_parser('check-plans', help='EXPLAIN every data_manager query, fail on sequential scans')
+    plans.add_argument('--large-table-rows', type=int, default=plan_check.LARGE_TABLE_ROWS,
+                       help='tables with more rows than this count as large')
+    plans.add_argument('--no-analyze', action='store_true', help='skip VACUUM ANALYZE before explaining')
+    plans.add_argument('--verbose', action='store_true')
+    plans.set_defaults(handler=check_plans)
+
+    profiles = commands.add_parser('hot-stacks', help='summarize the sampled stacks collected by the profiler')
+    profiles.add_argument('--folder', default=profiler.PROFILE_FOLDER)
+    profiles.add_argument('--limit', type=int, default=20)
+    profiles.set_defaults(handler=hot_stacks)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
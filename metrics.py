@@ -0,0 +1,110 @@
+import bisect
+import threading
+
+# upper bounds in seconds, from sub-millisecond index lookups to multi-second scans
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_descriptions = {}
+_counters = {}
+_histograms = {}
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # the last slot counts observations above the largest bucket (le="+Inf" only)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def describe(name, kind, help_text):
+    _descriptions[name] = (kind, help_text)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def increment(name, value=1, **labels):
+    key = (name, _label_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    key = (name, _label_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = Histogram()
+        histogram.observe(value)
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, bool):
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _header(lines, name, default_kind):
+    kind, help_text = _descriptions.get(name, (default_kind, ''))
+    if help_text:
+        lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} {kind}')
+
+
+def render(gauges=()):
+    # Prometheus text exposition format; gauges are (name, labels, value) sampled by the caller right now
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(((key, histogram.counts[:], histogram.sum, histogram.count, histogram.buckets)
+                             for key, histogram in _histograms.items()), key=lambda item: item[0])
+    last_name = None
+    for (name, labels), value in counters:
+        if name != last_name:
+            _header(lines, name, 'counter')
+            last_name = name
+        lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+    for (name, labels), counts, total, count, buckets in histograms:
+        if name != last_name:
+            _header(lines, name, 'histogram')
+            last_name = name
+        cumulative = 0
+        for bound, bucket_count in zip(buckets, counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{_format_labels(labels + (("le", bound),))} {cumulative}')
+        lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {count}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+        lines.append(f'{name}_count{_format_labels(labels)} {count}')
+    for name, labels, value in sorted(gauges, key=lambda gauge: gauge[0]):
+        if value is None:
+            continue
+        if name != last_name:
+            _header(lines, name, 'gauge')
+            last_name = name
+        lines.append(f'{name}{_format_labels(_label_key(labels))} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,106 @@
+import glob
+import hashlib
+import os
+import re
+
+import database_common as db
+
+MIGRATIONS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sql')
+MIGRATION_FILE = re.compile(r'^(\d{3})_(\w+)\.sql$')
+# any constant works, it only has to be the same for every process running migrations
+MIGRATION_LOCK_ID = 4201
+
+
+class Migration:
+    def __init__(self, path):
+        self.path = path
+        self.version, self.name = MIGRATION_FILE.match(os.path.basename(path)).groups()
+        with open(path, encoding='utf-8') as file:
+            self.sql = file.read()
+        self.checksum = hashlib.sha256(self.sql.encode()).hexdigest()
+
+
+def load_migrations(folder=MIGRATIONS_FOLDER):
+    migrations = [Migration(path) for path in sorted(glob.glob(os.path.join(folder, '*.sql')))
+                  if MIGRATION_FILE.match(os.path.basename(path))]
+    versions = [migration.version for migration in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f'Duplicate migration versions in {folder}')
+    return migrations
+
+
+def _ensure_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            checksum TEXT NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+
+
+def _applied(cursor):
+    cursor.execute('SELECT version, checksum FROM schema_migrations;')
+    return dict(cursor.fetchall())
+
+
+def status(folder=MIGRATIONS_FOLDER):
+    connection = db.open_database()
+    try:
+        with connection.cursor() as cursor:
+            _ensure_table(cursor)
+            applied = _applied(cursor)
+    finally:
+        connection.close()
+    rows = []
+    for migration in load_migrations(folder):
+        if migration.version not in applied:
+            state = 'pending'
+        elif applied[migration.version] != migration.checksum:
+            state = 'changed since applied'
+        else:
+            state = 'applied'
+        rows.append((migration, state))
+    return rows
+
+
+def migrate(folder=MIGRATIONS_FOLDER, target=None):
+    connection = db.open_database()
+    connection.autocommit = False
+    try:
+        with connection.cursor() as cursor:
+            # two deploys starting at once must not apply the same file twice
+            cursor.execute('SELECT pg_advisory_xact_lock(%(lock)s);', {'lock': MIGRATION_LOCK_ID})
+            _ensure_table(cursor)
+            migrations = load_migrations(folder)
+            applied = _applied(cursor)
+            # an applied file that was edited afterwards would otherwise be skipped without a word
+            changed = [f'{migration.version}_{migration.name}' for migration in migrations
+                       if migration.version in applied and applied[migration.version] != migration.checksum]
+            if changed:
+                raise ValueError(f'Applied migrations changed since they were applied: {", ".join(changed)}')
+            connection.commit()
+            for migration in migrations:
+                if target is not None and migration.version > target:
+                    break
+                cursor.execute('SELECT pg_advisory_xact_lock(%(lock)s);', {'lock': MIGRATION_LOCK_ID})
+                cursor.execute('SELECT checksum FROM schema_migrations WHERE version = %(version)s;',
+                               {'version': migration.version})
+                row = cursor.fetchone()
+                if row is not None:
+                    connection.rollback()
+                    if row[0] != migration.checksum:
+                        raise ValueError(f'Migration {migration.version}_{migration.name} changed since it was applied')
+                    continue
+                # each file and its bookkeeping row commit together, so a failed file leaves no trace
+                cursor.execute(migration.sql)
+                cursor.execute("""
+                    INSERT INTO schema_migrations (version, name, checksum)
+                    VALUES (%(version)s, %(name)s, %(checksum)s);
+                """, {'version': migration.version, 'name': migration.name, 'checksum': migration.checksum})
+                connection.commit()
+                yield migration
+    finally:
+        connection.rollback()
+        connection.close()
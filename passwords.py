@@ -0,0 +1,138 @@
+import asyncio
+import atexit
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+import counter_buffer
+
+# bcrypt work factor for new hashes; stored hashes with another factor are rehashed at the next login
+BCRYPT_ROUNDS = int(os.environ.get('ASKMATE_BCRYPT_ROUNDS', 12))
+# few workers on purpose: a burst of signups queues up here instead of taking every core from page rendering
+PASSWORD_WORKERS = int(os.environ.get('ASKMATE_PASSWORD_WORKERS', 2))
+PASSWORD_QUEUE_SIZE = int(os.environ.get('ASKMATE_PASSWORD_QUEUE_SIZE', 32))
+PASSWORD_QUEUE_TIMEOUT = float(os.environ.get('ASKMATE_PASSWORD_QUEUE_TIMEOUT', 10))
+# an account is locked for the rest of the window after this many failed logins
+LOGIN_FAILURE_LIMIT = int(os.environ.get('ASKMATE_LOGIN_FAILURE_LIMIT', 5))
+LOGIN_FAILURE_WINDOW = float(os.environ.get('ASKMATE_LOGIN_FAILURE_WINDOW', 300))
+
+_executor = None
+_executor_lock = threading.Lock()
+_queue_slots = threading.BoundedSemaphore(PASSWORD_QUEUE_SIZE)
+# the async server waits for a slot here, on its event loop, instead of in _queue_slots.acquire
+_async_queue_slots = asyncio.Semaphore(PASSWORD_QUEUE_SIZE)
+login_failures = counter_buffer.RateTracker(LOGIN_FAILURE_WINDOW, LOGIN_FAILURE_LIMIT - 1)
+
+
+class PasswordServiceBusy(Exception):
+    pass
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('UTF-8'), bcrypt.gensalt(rounds)).decode('UTF-8')
+
+
+def _check(password, password_hash):
+    return bcrypt.checkpw(password.encode('UTF-8'), password_hash)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(max_workers=PASSWORD_WORKERS)
+                atexit.register(_executor.shutdown, wait=False)
+    return _executor
+
+
+def _submit(function, *args, wait=True):
+    acquired = _queue_slots.acquire(timeout=PASSWORD_QUEUE_TIMEOUT) if wait else _queue_slots.acquire(blocking=False)
+    if not acquired:
+        raise PasswordServiceBusy('Too many password operations in progress')
+    try:
+        future = _get_executor().submit(function, *args)
+    except BaseException:
+        _queue_slots.release()
+        raise
+    future.add_done_callback(lambda _: _queue_slots.release())
+    return future
+
+
+async def _submit_async(function, *args):
+    try:
+        await asyncio.wait_for(_async_queue_slots.acquire(), PASSWORD_QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise PasswordServiceBusy('Too many password operations in progress')
+    try:
+        # never blocks: the slots are shared with any synchronous caller in the process, so one may still be taken
+        return await asyncio.wrap_future(_submit(function, *args, wait=False))
+    finally:
+        _async_queue_slots.release()
+
+
+def _as_bytes(password_hash):
+    # older rows hold the bytes psycopg2 wrote for a bytes value: bytea, or its '\x..' text form
+    if isinstance(password_hash, memoryview):
+        return password_hash.tobytes()
+    if isinstance(password_hash, str):
+        if password_hash.startswith('\\x'):
+            return bytes.fromhex(password_hash[2:])
+        return password_hash.encode('UTF-8')
+    return password_hash
+
+
+def submit_hash(password):
+    return _submit(_hash, password, BCRYPT_ROUNDS)
+
+
+def submit_verify(password, password_hash):
+    return _submit(_check, password, _as_bytes(password_hash))
+
+
+def hash_password(password):
+    return submit_hash(password).result()
+
+
+def verify_password(password, password_hash):
+    if not password_hash:
+        return False
+    try:
+        return submit_verify(password, password_hash).result()
+    except ValueError:
+        # not a bcrypt hash at all
+        return False
+
+
+async def hash_password_async(password):
+    return await _submit_async(_hash, password, BCRYPT_ROUNDS)
+
+
+async def verify_password_async(password, password_hash):
+    if not password_hash:
+        return False
+    try:
+        return await _submit_async(_check, password, _as_bytes(password_hash))
+    except ValueError:
+        return False
+
+
+def needs_rehash(password_hash):
+    try:
+        return int(_as_bytes(password_hash).split(b'$')[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+def login_throttled(email):
+    return login_failures.exceeded(email.lower())
+
+
+def record_login_failure(email):
+    login_failures.hit(email.lower())
+
+
+def record_login_success(email):
+    login_failures.reset(email.lower())
@@ -0,0 +1,161 @@
+import inspect
+
+import psycopg2.extras
+
+import data_manager as dm
+import database_common as db
+
+# tables with more estimated rows than this must not be read with a sequential scan
+LARGE_TABLE_ROWS = 1000
+# (function, table) pairs that read the whole table by design
+ALLOWED_SEQ_SCANS = {
+    ('load_tags', 'tag'),
+}
+
+
+class ExplainCursor(psycopg2.extras.RealDictCursor):
+    # records the plan of every statement, then runs it so the function sees its normal results
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.plans = []
+
+    def execute(self, query, vars=None):
+        statement = self.mogrify(query, vars)
+        super().execute(b'EXPLAIN (FORMAT JSON) ' + statement)
+        self.plans.append((statement.decode(errors='replace'), super().fetchone()['QUERY PLAN'][0]['Plan']))
+        return super().execute(query, vars)
+
+    def execute_prepared(self, name, query, vars=None):
+        # the statement text is explained directly, EXPLAIN EXECUTE would need it prepared in this session first
+        return self.execute(query, vars)
+
+
+def _sample(cursor):
+    # rows without images, so the delete checks have nothing to remove from disk even in their callbacks
+    cursor.execute("""
+        SELECT question.id AS question_id, answer.id AS answer_id,
+               (SELECT id FROM comment WHERE answer_id IS NOT NULL ORDER BY id LIMIT 1) AS comment_id,
+               (SELECT tag_id FROM question_tag ORDER BY tag_id LIMIT 1) AS tag_id,
+               (SELECT name FROM tag ORDER BY id LIMIT 1) AS tag_name,
+               (SELECT id FROM users ORDER BY id LIMIT 1) AS user_id,
+               (SELECT email FROM users ORDER BY id LIMIT 1) AS email
+        FROM question
+        JOIN answer ON answer.question_id = question.id
+        WHERE COALESCE(question.image, '') = ''
+          AND NOT EXISTS (SELECT 1 FROM answer AS other
+                          WHERE other.question_id = question.id AND COALESCE(other.image, '') <> '')
+        ORDER BY question.id
+        LIMIT 1;
+    """)
+    sample = cursor.fetchone()
+    if sample is None or None in sample.values():
+        raise SystemExit('not enough rows to check against, seed the database first')
+    return sample
+
+
+def plan_checks(sample):
+    question_id, answer_id, comment_id = sample['question_id'], sample['answer_id'], sample['comment_id']
+    tag_id = sample['tag_id']
+    first_page = dm.get_questions_page('submission_time', 'desc')
+    checks = [(f'get_questions_page({order_by}, {direction})', dm.get_questions_page, (order_by, direction), {})
+              for order_by in dm.QUESTION_SORT_KEYS for direction in ('asc', 'desc')]
+    checks += [
+        ('get_questions_page(next page)', dm.get_questions_page, ('submission_time', 'desc', first_page['next_cursor']), {}),
+        ('get_questions_page(tag)', dm.get_questions_page, ('submission_time', 'desc'), {'tag_id': tag_id}),
+        ('get_latest_questions', dm.get_latest_questions, (5,), {}),
+        ('get_listing_version', dm.get_listing_version, (), {}),
+        ('get_question_version', dm.get_question_version, (question_id,), {}),
+        ('load_question_page', dm.load_question_page, (question_id,), {}),
+        ('get_question_by_id', dm.get_question_by_id, (question_id,), {}),
+        ('get_image_link_by_question_id', dm.get_image_link_by_question_id, (question_id,), {}),
+        ('get_answer_by_id', dm.get_answer_by_id, (answer_id,), {}),
+        ('get_question_id_by_answer', dm.get_question_id_by_answer, (answer_id,), {}),
+        ('get_question_id_by_answer_id', dm.get_question_id_by_answer_id, (answer_id,), {}),
+        ('get_comment_by_id', dm.get_comment_by_id, (comment_id,), {}),
+        ('get_question_id_by_comment', dm.get_question_id_by_comment, (comment_id,), {}),
+        # a term few rows contain: a phrase found in most rows is rightly answered with a sequential scan
+        ('search_results', dm.search_results, ('zeppelin',), {}),
+        ('load_tags', dm.load_tags, (), {}),
+        ('load_tag_id', dm.load_tag_id, (sample['tag_name'],), {}),
+        ('get_tag_cloud', dm.get_tag_cloud, (), {}),
+        ('get_user_credentials', dm.get_user_credentials, (sample['email'],), {}),
+        ('add_question', dm.add_question, ('plan check', 'plan check'), {}),
+        ('add_answer', dm.add_answer, (question_id, 'plan check'), {}),
+        ('add_comment_to_question', dm.add_comment_to_question, (question_id, 'plan check'), {}),
+        ('add_comment_to_answer', dm.add_comment_to_answer, (answer_id, 'plan check'), {}),
+        ('edit_question', dm.edit_question, (question_id, 'plan check', 'plan check'), {}),
+        ('edit_answer', dm.edit_answer, (answer_id, 'plan check'), {}),
+        ('edit_comment', dm.edit_comment, (comment_id, 'plan check'), {}),
+        ('cast_vote(question)', dm.cast_vote, ('question', question_id, sample['user_id'], 1), {}),
+        ('cast_vote(answer)', dm.cast_vote, ('answer', answer_id, sample['user_id'], 1), {}),
+        ('flush_vote_counters', dm.flush_vote_counters, ([(('question', question_id), 1), (('answer', answer_id), 1)],), {}),
+        ('flush_question_views', dm.flush_question_views, ([(question_id, 1)],), {}),
+        ('add_tags', dm.add_tags, (question_id, [tag_id]), {}),
+        ('upsert_tags', dm.upsert_tags, (['plan-check'],), {}),
+        ('delete_tag_from_question', dm.delete_tag_from_question, (question_id, tag_id), {}),
+        ('delete_comments', dm.delete_comments, ([comment_id],), {}),
+        ('delete_answers', dm.delete_answers, ([answer_id],), {}),
+        ('delete_questions', dm.delete_questions, ([question_id],), {}),
+        ('update_password_hash', dm.update_password_hash, (sample['user_id'], 'plan check'), {}),
+        ('repair_question_activity', dm.repair_question_activity, (question_id - 1, 10), {}),
+    ]
+    return checks
+
+
+def seq_scans(plan):
+    if plan.get('Node Type') == 'Seq Scan':
+        yield plan['Relation Name']
+    for child in plan.get('Plans', ()):
+        yield from seq_scans(child)
+
+
+def describe(plan, depth=0):
+    node = plan['Node Type']
+    if 'Relation Name' in plan:
+        node += f" on {plan['Relation Name']}"
+    if 'Index Name' in plan:
+        node += f" using {plan['Index Name']}"
+    lines = [f"{'  ' * depth}{node} (rows={plan['Plan Rows']}, cost={plan['Total Cost']})"]
+    for child in plan.get('Plans', ()):
+        lines += describe(child, depth + 1)
+    return lines
+
+
+def unchecked_functions(checks):
+    checked = {inspect.unwrap(function) for _, function, _, _ in checks}
+    return sorted(name for name, function in vars(dm).items()
+                  if inspect.isfunction(function) and hasattr(function, '__wrapped__')
+                  and inspect.unwrap(function) not in checked)
+
+
+def check_plans(large_table_rows=LARGE_TABLE_ROWS, analyze=True):
+    connection = db.open_database()
+    try:
+        with connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+            if analyze:
+                # VACUUM also merges the GIN pending lists a bulk load leaves behind, which skew the search plans
+                cursor.execute('VACUUM ANALYZE;')
+            cursor.execute("""
+                SELECT relname FROM pg_class
+                WHERE relkind = 'r' AND relnamespace = current_schema()::regnamespace
+                  AND reltuples > %(rows)s;
+            """, {'rows': large_table_rows})
+            large_tables = {row['relname'] for row in cursor.fetchall()}
+            checks = plan_checks(_sample(cursor))
+        connection.autocommit = False
+        results = []
+        for label, function, args, kwargs in checks:
+            # the undecorated function runs on an explaining cursor; its writes are rolled back right after
+            with connection.cursor(cursor_factory=ExplainCursor) as cursor:
+                try:
+                    inspect.unwrap(function)(cursor, *args, **kwargs)
+                finally:
+                    connection.rollback()
+            name = inspect.unwrap(function).__name__
+            for statement, plan in cursor.plans:
+                offending = sorted({table for table in seq_scans(plan)
+                                    if table in large_tables and (name, table) not in ALLOWED_SEQ_SCANS})
+                results.append((label, statement, plan, offending))
+    finally:
+        connection.close()
+    return large_tables, results, unchecked_functions(checks)
@@ -0,0 +1,158 @@
+import collections
+import cProfile
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+
+from werkzeug.exceptions import HTTPException
+
+# fraction of requests to profile, e.g. 0.01; 0 disables sampling
+PROFILE_RATE = float(os.environ.get('ASKMATE_PROFILE_RATE', 0))
+# when set, a request carrying `X-Profile: <token>` is always profiled
+PROFILE_TOKEN = os.environ.get('ASKMATE_PROFILE_TOKEN', '')
+PROFILE_FOLDER = os.environ.get('ASKMATE_PROFILE_FOLDER', '/tmp/askmate-profiles')
+SAMPLE_INTERVAL = float(os.environ.get('ASKMATE_PROFILE_SAMPLE_INTERVAL', 0.002))
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+
+
+# walks the request thread's Python stack every `interval` seconds and counts identical stacks
+class StackSampler:
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='askmate-stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[_fold(frame)] += 1
+
+
+def _fold(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class ProfilerMiddleware:
+    def __init__(self, wsgi_app, url_map, folder=PROFILE_FOLDER, rate=PROFILE_RATE, token=PROFILE_TOKEN,
+                 sample_interval=SAMPLE_INTERVAL):
+        self.wsgi_app = wsgi_app
+        self.url_map = url_map
+        self.folder = folder
+        self.rate = rate
+        self.token = token
+        self.sample_interval = sample_interval
+        self._stats = {}
+        self._stacks = {}
+        self._save_lock = threading.Lock()
+        # only one cProfile may be active per process, concurrent requests are simply not profiled
+        self._profile_lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def _wanted(self, environ):
+        if self.token and environ.get(PROFILE_HEADER) == self.token:
+            return True
+        return self.rate > 0 and random.random() < self.rate
+
+    def _route(self, environ):
+        try:
+            endpoint, _ = self.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            endpoint = 'not_found'
+        return re.sub(r'[^\w.-]', '_', endpoint)
+
+    def __call__(self, environ, start_response):
+        if not self._wanted(environ) or not self._profile_lock.acquire(blocking=False):
+            return self.wsgi_app(environ, start_response)
+        try:
+            profile = cProfile.Profile()
+            sampler = StackSampler(threading.get_ident(), self.sample_interval)
+            started = time.perf_counter()
+            sampler.start()
+            profile.enable()
+            try:
+                # the body is consumed here so that template streaming is part of the profile
+                iterable = self.wsgi_app(environ, start_response)
+                try:
+                    body = list(iterable)
+                finally:
+                    if hasattr(iterable, 'close'):
+                        iterable.close()
+            finally:
+                profile.disable()
+                sampler.stop()
+            self._save(self._route(environ), profile, sampler.stacks, time.perf_counter() - started)
+            return body
+        finally:
+            self._profile_lock.release()
+
+    def _save(self, route, profile, stacks, elapsed):
+        prof_path = os.path.join(self.folder, f'{route}.prof')
+        folded_path = os.path.join(self.folder, f'{route}.folded')
+        with self._save_lock:
+            # both files accumulate over every profiled request of the route, also across restarts
+            if route not in self._stats:
+                self._stats[route] = pstats.Stats(prof_path) if os.path.exists(prof_path) else None
+                self._stacks[route] = read_folded(folded_path) if os.path.exists(folded_path) else collections.Counter()
+            if self._stats[route] is None:
+                self._stats[route] = pstats.Stats(profile)
+            else:
+                self._stats[route].add(profile)
+            self._stats[route].dump_stats(prof_path)
+            self._stacks[route].update(stacks)
+            write_folded(folded_path, self._stacks[route])
+            with open(os.path.join(self.folder, 'requests.log'), 'a') as file:
+                file.write(f'{time.strftime("%Y-%m-%dT%H:%M:%S")} {route} {elapsed * 1000:.1f}ms\n')
+
+
+def write_folded(path, stacks):
+    # one "frame;frame;frame count" line per stack, as read by flamegraph.pl and speedscope
+    with open(path, 'w') as file:
+        for stack, count in stacks.most_common():
+            file.write(f'{stack} {count}\n')
+
+
+def read_folded(path):
+    stacks = collections.Counter()
+    with open(path) as file:
+        for line in file:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                stacks[stack] += int(count)
+    return stacks
+
+
+def hot_frames(stacks, limit=20):
+    # samples in which each frame was on the stack (inclusive) and on top of it (self)
+    inclusive, own = collections.Counter(), collections.Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        for frame in set(frames):
+            inclusive[frame] += count
+        own[frames[-1]] += count
+    return [(frame, own[frame], inclusive[frame]) for frame, _ in own.most_common(limit)]
+
+
+def init_app(app):
+    # with no rate and no token the app is left untouched, so disabled profiling costs nothing
+    if PROFILE_RATE <= 0 and not PROFILE_TOKEN:
+        return
+    app.wsgi_app = ProfilerMiddleware(app.wsgi_app, app.url_map)
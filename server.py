@@ -1,45 +1,184 @@
-from flask import Flask, render_template, request, url_for, redirect, session
+import time
+
+from flask import Flask, render_template, request, url_for, redirect, session, make_response, g
+from markupsafe import Markup
+
+import assets
+import cache
 import data_manager as dm
-import util
+import database_common as db
+import image_store
+import metrics
+import passwords
+import profiler
+import web_common
 
 app = Flask(__name__, template_folder='templates')
 app.secret_key = 'ff'
+# leaves room for the text fields next to the largest accepted image
+app.config['MAX_CONTENT_LENGTH'] = image_store.MAX_IMAGE_BYTES + 64 * 1024
+app.jinja_env.globals['image_url'] = image_store.image_url
+app.jinja_env.globals['asset_url'] = assets.asset_url
+profiler.init_app(app)
+ANSWER_FRAGMENT_TTL = 3600
+metrics.describe('askmate_http_request_seconds', 'histogram', 'Time spent handling requests, per endpoint.')
+metrics.describe('askmate_cache_operations_total', 'counter', 'Cache hits, misses and invalidations.')
+
+
+@app.before_request
+def begin_unit_of_work():
+    g.request_started = time.perf_counter()
+    db.begin_unit_of_work()
+
+
+@app.after_request
+def commit_unit_of_work(response):
+    # after_request also runs for the 500 of an unhandled exception; that work is rolled back in teardown instead
+    if response.status_code < 500:
+        db.commit_unit_of_work()
+    return response
+
+
+@app.after_request
+def record_request(response):
+    metrics.observe('askmate_http_request_seconds', time.perf_counter() - g.request_started,
+                    endpoint=request.endpoint or 'not_found')
+    if app.debug:
+        response.headers['X-Query-Count'] = str(g.get('db_query_count', 0))
+    return response
+
+
+@app.teardown_request
+def end_unit_of_work(exception):
+    db.end_unit_of_work(exception)
+
+
+def _runtime_gauges():
+    gauges = [(f'askmate_db_pool_{name}', {}, value) for name, value in db.pool_stats().items()]
+    gauges += [(f'askmate_db_prepared_{name}', {}, value) for name, value in db.prepared_statement_stats().items()]
+    for buffer_name, buffer in (('views', dm.view_counter), ('votes', dm.vote_counters)):
+        gauges += [(f'askmate_counter_buffer_{name}', {'buffer': buffer_name}, value)
+                   for name, value in buffer.metrics().items()]
+    cache_stats = cache.stats()
+    gauges.append(('askmate_cache_entries', {'backend': cache_stats['backend']}, cache_stats['entries']))
+    for namespace, counters in cache_stats['namespaces'].items():
+        gauges += [('askmate_cache_operations_total', {'namespace': namespace, 'outcome': outcome}, count)
+                   for outcome, count in counters.items()]
+    return gauges
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return metrics.render(_runtime_gauges()), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+def conditional_response(version, render):
+    if version is None:
+        return render()
+    etag, last_modified = web_common.page_validators(version, request, session.get('user'))
+    if web_common.not_modified(request, etag, last_modified):
+        response = make_response('', 304)
+    else:
+        response = make_response(render())
+    return web_common.set_validators(response, etag, last_modified)
+
+
+@app.route('/assets/<path:filename>')
+def serve_asset(filename):
+    return assets.send_asset(filename)
 
 
 @app.route('/')
 def index():
-    latest_questions = dm.get_latest_questions(5)
-    return render_template('index.html', latest_questions=latest_questions, session=session)
+    version = dm.get_listing_version()
+
+    def render():
+        latest_questions = dm.get_latest_questions(5, listing_version=dm.listing_cache_key(version))
+        return render_template('index.html', latest_questions=latest_questions, session=session)
+
+    return conditional_response(version, render)
+
+
+def _questions_page(version, order_by, order_direction, tag_id=None):
+    return dm.get_questions_page(order_by, order_direction, web_common.page_cursor(request.args), tag_id=tag_id,
+                                 listing_version=dm.listing_cache_key(version))
 
 
 @app.route("/list", methods=['GET'])
 def list_questions():
-    order_by = request.args.get('order_by', 'submission_time')
-    order_direction = request.args.get('order_direction', 'desc')
-    questions = dm.display_questions()  # ?
-    sorted_questions = dm.sort_questions(order_by, order_direction)  # ?
-    sorted_questions = dm.sort_questions(order_by, order_direction)
-    return render_template('list.html',
-                           questions=sorted_questions,
-                           order_by=order_by,
-                           order_direction=order_direction)
+    version = dm.get_listing_version()
+
+    def render():
+        order_by, order_direction = web_common.sort_order(request.args)
+        page = _questions_page(version, order_by, order_direction)
+        return render_template('list.html',
+                               questions=page['questions'],
+                               next_cursor=page['next_cursor'],
+                               prev_cursor=page['prev_cursor'],
+                               order_by=order_by,
+                               order_direction=order_direction)
+
+    return conditional_response(version, render)
+
+
+@app.route("/tag/<tag_name>", methods=['GET'])
+def list_questions_by_tag(tag_name):
+    tag_id = dm.get_tag_id(tag_name)
+    if tag_id is None:
+        return "Error: Tag not found", 404
+    version = dm.get_listing_version()
+
+    def render():
+        order_by, order_direction = web_common.sort_order(request.args)
+        page = _questions_page(version, order_by, order_direction, tag_id)
+        return render_template('list.html',
+                               questions=page['questions'],
+                               next_cursor=page['next_cursor'],
+                               prev_cursor=page['prev_cursor'],
+                               order_by=order_by,
+                               order_direction=order_direction,
+                               tag_name=tag_name)
+
+    return conditional_response(version, render)
+
+
+@app.route("/tags", methods=['GET'])
+def tag_cloud():
+    tags = dm.get_tag_cloud()
+    max_count = max((tag['question_count'] for tag in tags), default=1)
+    return render_template('tags.html', tags=tags, max_count=max_count)
 
 
 @app.route('/question/<int:question_id>')
 def display_question(question_id):
+    version = dm.get_question_version(question_id)
+    if version is None:
+        return "Error: Question not found", 404
     dm.update_question_views(question_id)
-    question = dm.get_question_by_id(question_id)
-    comments_to_question = dm.get_comments_for_question(question_id)
-    answers = dm.get_answers_for_question(question_id)
-    comments_to_answers = dm.get_comments_for_answers(question_id)
-    tags = dm.get_question_tags(question_id)
-    return render_template('question.html',
-                           question=question,
-                           comments_to_question=comments_to_question,
-                           answers=answers,
-                           comments_to_answers=comments_to_answers,
-                           question_id=question_id,
-                           tags=tags)
+
+    def render():
+        page = dm.load_question_page_at(question_id, version['revision'])
+        return render_template('question.html',
+                               question=page['question'],
+                               comments_to_question=page['comments'],
+                               answers=page['answers'],
+                               answer_html=answer_html,
+                               question_id=question_id,
+                               tags=page['tags'])
+
+    return conditional_response(version, render)
+
+
+def answer_html(answer):
+    # rendered answer blocks are reused until the answer or one of its comments changes
+    def render():
+        return answer['revision'], render_template('_answer.html', answer=answer)
+
+    revision, html = cache.get_or_set('answer_fragment', (answer['id'],), ANSWER_FRAGMENT_TTL, render)
+    if revision != answer['revision']:
+        revision, html = render()
+        cache.set('answer_fragment', (answer['id'],), (revision, html), ANSWER_FRAGMENT_TTL)
+    return Markup(html)
 
 
 @app.route('/image/<int:question_id>')
@@ -53,12 +192,15 @@ def add_question():
     if request.method == 'GET':
         return render_template('add_question.html')
     elif request.method == 'POST':
-        file = request.files['image']
-        if file.filename != '':
-            file.save(f'static/images/{file.filename}')
+        file = request.files.get('image')
+        image = None
+        if file is not None and file.filename != '':
+            try:
+                image = image_store.save_upload(file)
+            except image_store.ImageRejected as error:
+                return f"Error: {error}", 400
         title = request.form.get('title')
         message = request.form.get('message')
-        image = file.filename
         new_question_id = dm.add_question(title, message, image=image)
         return redirect(url_for('display_question', question_id=new_question_id))
 
@@ -105,25 +247,44 @@ def delete_answer(answer_id):
 
 @app.route('/question/<int:question_id>/vote-up', methods=['POST'])
 def vote_up(question_id):
-    dm.vote_question(question_id, 'up')
+    if 'user' not in session:
+        return redirect(url_for('registration'))
+    dm.vote('question', question_id, session['user'], 'up')
     return redirect(url_for('list_questions'))
 
 
 @app.route('/question/<int:question_id>/vote-down', methods=['POST'])
 def vote_down(question_id):
-    dm.vote_question(question_id, 'down')
+    if 'user' not in session:
+        return redirect(url_for('registration'))
+    dm.vote('question', question_id, session['user'], 'down')
     return redirect(url_for('list_questions'))
 
 
+@app.route('/answer/<int:answer_id>/vote-up', methods=['POST'])
+def vote_up_answer(answer_id):
+    if 'user' not in session:
+        return redirect(url_for('registration'))
+    dm.vote('answer', answer_id, session['user'], 'up')
+    question_id = dm.get_question_id_by_answer_id(answer_id)
+    return redirect(url_for('display_question', question_id=question_id))
+
+
+@app.route('/answer/<int:answer_id>/vote-down', methods=['POST'])
+def vote_down_answer(answer_id):
+    if 'user' not in session:
+        return redirect(url_for('registration'))
+    dm.vote('answer', answer_id, session['user'], 'down')
+    question_id = dm.get_question_id_by_answer_id(answer_id)
+    return redirect(url_for('display_question', question_id=question_id))
+
+
 @app.route('/search_results')
 def search_results():
-    search_phrase = request.args.get('q')
-    if len(search_phrase) > 0:
-        results = dm.search_results(search_phrase)  # Wywołanie funkcji wyszukującej
-        results = util.underline_phrase(results, search_phrase)
-    else:
-        results = 'No results'
-    return render_template('search_results.html', search_phrase=search_phrase, results=results)
+    search_phrase = request.args.get('q', '')
+    search = dm.search_results(search_phrase, web_common.search_page(request.args)) if search_phrase else None
+    return render_template('search_results.html', search_phrase=search_phrase,
+                           results=web_common.search_listing(search), search=search)
 
 
 @app.route('/answer/<answer_id>/edit', methods=['GET', 'POST'])
@@ -144,13 +305,10 @@ def add_tag(question_id):
         current_tags = dm.get_existing_tags()
         return render_template('add_tag.html', question_id=question_id, current_tags=current_tags)
     elif request.method == 'POST':
-        tag_id = request.form.get('tag')
-        if tag_id == "add_new_tag":
-            new_tag = request.form.get('new_tag')
-            tag_id = dm.add_new_tag(new_tag)
-            dm.add_tag(tag_id, question_id)
-        elif tag_id is not None:
-            dm.add_tag(tag_id, question_id)
+        tag_ids, new_tags = web_common.selected_tags(request.form)
+        if new_tags:
+            tag_ids += dm.add_new_tags(new_tags)
+        dm.add_tags(question_id, tag_ids)
         return redirect(url_for('display_question', question_id=question_id))
 
 
@@ -198,12 +356,7 @@ def delete_comment(comment_id):
     if question_id is not None:
         return redirect(url_for('display_question', question_id=question_id))
     else:
-        answer_id = dm.delete_comment(comment_id)
-        if answer_id is not None:
-            question_id = dm.get_question_id_by_answer_id(answer_id)
-            return redirect(url_for('display_question', question_id=question_id))
-        else:
-            return "Error: Comment ID not found"
+        return "Error: Comment ID not found"
 
 
 @app.route('/registration', methods=["GET", "POST"])
@@ -213,11 +366,43 @@ def registration():
     elif request.method == 'POST':
         email = request.form.get("email")
         password = request.form.get("password")
-        user_id = dm.register_user(email, password)
+        try:
+            password_hash = passwords.hash_password(password)
+        except passwords.PasswordServiceBusy:
+            return "Error: Too many registrations at once, please try again", 503
+        user_id = dm.register_user(email, password_hash)
         session["user"] = user_id   # otwarcie sesji
         return redirect(url_for('index'))
 
 
+@app.route('/login', methods=["GET", "POST"])
+def login():
+    if request.method == 'GET':
+        return render_template('login.html')
+    email = request.form.get("email", '')
+    password = request.form.get("password", '')
+    if passwords.login_throttled(email):
+        return render_template('login.html', error='Too many failed attempts, please try again later'), 429
+    # the connection is given back before bcrypt runs; a login holds it only for the lookup
+    user = dm.get_user_credentials(email, autocommit=True)
+    try:
+        verified = user is not None and passwords.verify_password(password, user['password'])
+    except passwords.PasswordServiceBusy:
+        return render_template('login.html', error='Too many logins at once, please try again'), 503
+    if not verified:
+        passwords.record_login_failure(email)
+        return render_template('login.html', error='Wrong email or password'), 401
+    passwords.record_login_success(email)
+    if passwords.needs_rehash(user['password']):
+        # the password was already verified; a busy service only postpones the upgrade to a later login
+        try:
+            dm.update_password_hash(user['id'], passwords.hash_password(password))
+        except passwords.PasswordServiceBusy:
+            pass
+    session["user"] = user['id']
+    return redirect(url_for('index'))
+
+
 @app.route('/logout')
 def logout():
     session.pop("user")
@@ -0,0 +1,46 @@
+-- the AskMate tables as every later migration expects them; IF NOT EXISTS keeps existing databases untouched
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    email TEXT,
+    password TEXT,
+    registration_date TIMESTAMP WITHOUT TIME ZONE
+);
+
+CREATE TABLE IF NOT EXISTS question (
+    id SERIAL PRIMARY KEY,
+    submission_time TIMESTAMP WITHOUT TIME ZONE,
+    view_number INTEGER,
+    vote_number INTEGER,
+    title TEXT,
+    message TEXT,
+    image TEXT
+);
+
+CREATE TABLE IF NOT EXISTS answer (
+    id SERIAL PRIMARY KEY,
+    submission_time TIMESTAMP WITHOUT TIME ZONE,
+    vote_number INTEGER,
+    question_id INTEGER REFERENCES question (id),
+    message TEXT,
+    image TEXT
+);
+
+CREATE TABLE IF NOT EXISTS comment (
+    id SERIAL PRIMARY KEY,
+    question_id INTEGER REFERENCES question (id),
+    answer_id INTEGER REFERENCES answer (id),
+    message TEXT,
+    submission_time TIMESTAMP WITHOUT TIME ZONE,
+    edited_count INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS tag (
+    id SERIAL PRIMARY KEY,
+    name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS question_tag (
+    question_id INTEGER NOT NULL REFERENCES question (id),
+    tag_id INTEGER NOT NULL REFERENCES tag (id),
+    PRIMARY KEY (question_id, tag_id)
+);
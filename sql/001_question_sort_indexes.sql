@@ -0,0 +1,6 @@
+-- composite indexes backing the keyset pagination of /list, one per whitelisted sort key
+-- (the trailing id makes the order total so a page boundary is never ambiguous)
+CREATE INDEX IF NOT EXISTS question_submission_time_id_idx ON question (submission_time, id);
+CREATE INDEX IF NOT EXISTS question_view_number_id_idx ON question (view_number, id);
+CREATE INDEX IF NOT EXISTS question_vote_number_id_idx ON question (vote_number, id);
+CREATE INDEX IF NOT EXISTS question_title_id_idx ON question (title, id);
@@ -0,0 +1,32 @@
+-- full-text search: maintained tsvector columns on question and answer with GIN indexes
+-- rows that existed before this migration are filled in by `python manage.py reindex-search`
+ALTER TABLE question ADD COLUMN IF NOT EXISTS search_vector tsvector;
+ALTER TABLE answer ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+CREATE OR REPLACE FUNCTION question_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A')
+                      || setweight(to_tsvector('english', coalesce(NEW.message, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION answer_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := setweight(to_tsvector('english', coalesce(NEW.message, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS question_search_vector_trigger ON question;
+CREATE TRIGGER question_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF title, message ON question
+    FOR EACH ROW EXECUTE FUNCTION question_search_vector_update();
+
+DROP TRIGGER IF EXISTS answer_search_vector_trigger ON answer;
+CREATE TRIGGER answer_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF message ON answer
+    FOR EACH ROW EXECUTE FUNCTION answer_search_vector_update();
+
+CREATE INDEX IF NOT EXISTS question_search_vector_idx ON question USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS answer_search_vector_idx ON answer USING GIN (search_vector);
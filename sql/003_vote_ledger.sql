@@ -0,0 +1,14 @@
+-- one row per (user, question) and (user, answer) vote, so repeating a vote changes nothing
+CREATE TABLE IF NOT EXISTS vote (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    question_id INTEGER REFERENCES question (id) ON DELETE CASCADE,
+    answer_id INTEGER REFERENCES answer (id) ON DELETE CASCADE,
+    value SMALLINT NOT NULL CHECK (value IN (-1, 1)),
+    CHECK ((question_id IS NULL) <> (answer_id IS NULL))
+);
+
+CREATE UNIQUE INDEX IF NOT EXISTS vote_user_question_idx ON vote (user_id, question_id) WHERE question_id IS NOT NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS vote_user_answer_idx ON vote (user_id, answer_id) WHERE answer_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS vote_question_id_idx ON vote (question_id) WHERE question_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS vote_answer_id_idx ON vote (answer_id) WHERE answer_id IS NOT NULL;
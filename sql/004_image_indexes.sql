@@ -0,0 +1,4 @@
+-- lets moderation check whether a deleted row's image file is still used by another question or answer;
+-- most rows store '' for "no image", and leaving those out keeps the index small
+CREATE INDEX IF NOT EXISTS question_image_idx ON question (image) WHERE image <> '';
+CREATE INDEX IF NOT EXISTS answer_image_idx ON answer (image) WHERE image <> '';
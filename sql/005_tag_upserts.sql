@@ -0,0 +1,3 @@
+-- unique key the single-statement tag upserts (INSERT ... ON CONFLICT) rely on;
+-- question_tag's primary key already covers (question_id, tag_id)
+CREATE UNIQUE INDEX IF NOT EXISTS tag_name_idx ON tag (name);
@@ -0,0 +1,47 @@
+-- per-tag question counts for the tag cloud, maintained by statement-level triggers on question_tag
+CREATE INDEX IF NOT EXISTS question_tag_tag_id_question_id_idx ON question_tag (tag_id, question_id);
+
+CREATE TABLE IF NOT EXISTS tag_question_count (
+    tag_id INTEGER PRIMARY KEY REFERENCES tag (id) ON DELETE CASCADE,
+    question_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS tag_question_count_question_count_idx ON tag_question_count (question_count DESC);
+
+INSERT INTO tag_question_count (tag_id, question_count)
+SELECT tag.id, COUNT(question_tag.question_id)
+FROM tag
+LEFT JOIN question_tag ON question_tag.tag_id = tag.id
+GROUP BY tag.id
+ON CONFLICT (tag_id) DO UPDATE SET question_count = EXCLUDED.question_count;
+
+CREATE OR REPLACE FUNCTION tag_question_count_insert() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO tag_question_count (tag_id, question_count)
+    SELECT tag_id, COUNT(*) FROM new_rows GROUP BY tag_id
+    ON CONFLICT (tag_id) DO UPDATE
+    SET question_count = tag_question_count.question_count + EXCLUDED.question_count;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION tag_question_count_delete() RETURNS trigger AS $$
+BEGIN
+    UPDATE tag_question_count
+    SET question_count = tag_question_count.question_count - removed.count
+    FROM (SELECT tag_id, COUNT(*) AS count FROM old_rows GROUP BY tag_id) AS removed
+    WHERE tag_question_count.tag_id = removed.tag_id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS question_tag_count_insert_trigger ON question_tag;
+CREATE TRIGGER question_tag_count_insert_trigger
+    AFTER INSERT ON question_tag
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tag_question_count_insert();
+
+DROP TRIGGER IF EXISTS question_tag_count_delete_trigger ON question_tag;
+CREATE TRIGGER question_tag_count_delete_trigger
+    AFTER DELETE ON question_tag
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION tag_question_count_delete();
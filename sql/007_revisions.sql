@@ -0,0 +1,111 @@
+-- revision counters behind the ETag / Last-Modified headers
+-- question.revision changes whenever anything shown on the question page changes;
+-- site_revision changes when questions are added or removed, for the list and index pages
+ALTER TABLE question ADD COLUMN IF NOT EXISTS revision INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE question ADD COLUMN IF NOT EXISTS last_modified TIMESTAMPTZ NOT NULL DEFAULT now();
+CREATE INDEX IF NOT EXISTS question_last_modified_idx ON question (last_modified);
+
+CREATE TABLE IF NOT EXISTS site_revision (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    revision BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO site_revision DEFAULT VALUES ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION touch_questions(question_ids INTEGER[]) RETURNS void AS $$
+    UPDATE question SET revision = revision + 1, last_modified = now()
+    WHERE id = ANY(question_ids);
+$$ LANGUAGE sql;
+
+-- view_number is left out on purpose: buffered view flushes must not invalidate every page
+CREATE OR REPLACE FUNCTION question_revision_bump() RETURNS trigger AS $$
+BEGIN
+    NEW.revision := OLD.revision + 1;
+    NEW.last_modified := now();
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS question_revision_trigger ON question;
+CREATE TRIGGER question_revision_trigger
+    BEFORE UPDATE ON question
+    FOR EACH ROW
+    WHEN ((OLD.title, OLD.message, OLD.image, OLD.vote_number)
+          IS DISTINCT FROM (NEW.title, NEW.message, NEW.image, NEW.vote_number))
+    EXECUTE FUNCTION question_revision_bump();
+
+CREATE OR REPLACE FUNCTION site_revision_bump() RETURNS trigger AS $$
+BEGIN
+    UPDATE site_revision SET revision = revision + 1;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS question_site_revision_trigger ON question;
+CREATE TRIGGER question_site_revision_trigger
+    AFTER INSERT OR DELETE ON question
+    FOR EACH STATEMENT EXECUTE FUNCTION site_revision_bump();
+
+CREATE OR REPLACE FUNCTION answer_touch_question() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM touch_questions(ARRAY(SELECT DISTINCT question_id FROM old_rows));
+    ELSE
+        PERFORM touch_questions(ARRAY(SELECT DISTINCT question_id FROM new_rows));
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION comment_touch_question() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM touch_questions(ARRAY(
+            SELECT DISTINCT COALESCE(old_rows.question_id, answer.question_id)
+            FROM old_rows LEFT JOIN answer ON answer.id = old_rows.answer_id));
+    ELSE
+        PERFORM touch_questions(ARRAY(
+            SELECT DISTINCT COALESCE(new_rows.question_id, answer.question_id)
+            FROM new_rows LEFT JOIN answer ON answer.id = new_rows.answer_id));
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION question_tag_touch_question() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM touch_questions(ARRAY(SELECT DISTINCT question_id FROM old_rows));
+    ELSE
+        PERFORM touch_questions(ARRAY(SELECT DISTINCT question_id FROM new_rows));
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- transition tables allow a single event per trigger, hence one trigger per event
+DROP TRIGGER IF EXISTS answer_insert_touch_trigger ON answer;
+CREATE TRIGGER answer_insert_touch_trigger AFTER INSERT ON answer
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION answer_touch_question();
+DROP TRIGGER IF EXISTS answer_update_touch_trigger ON answer;
+CREATE TRIGGER answer_update_touch_trigger AFTER UPDATE ON answer
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION answer_touch_question();
+DROP TRIGGER IF EXISTS answer_delete_touch_trigger ON answer;
+CREATE TRIGGER answer_delete_touch_trigger AFTER DELETE ON answer
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION answer_touch_question();
+
+DROP TRIGGER IF EXISTS comment_insert_touch_trigger ON comment;
+CREATE TRIGGER comment_insert_touch_trigger AFTER INSERT ON comment
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION comment_touch_question();
+DROP TRIGGER IF EXISTS comment_update_touch_trigger ON comment;
+CREATE TRIGGER comment_update_touch_trigger AFTER UPDATE ON comment
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION comment_touch_question();
+DROP TRIGGER IF EXISTS comment_delete_touch_trigger ON comment;
+CREATE TRIGGER comment_delete_touch_trigger AFTER DELETE ON comment
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION comment_touch_question();
+
+DROP TRIGGER IF EXISTS question_tag_insert_touch_trigger ON question_tag;
+CREATE TRIGGER question_tag_insert_touch_trigger AFTER INSERT ON question_tag
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION question_tag_touch_question();
+DROP TRIGGER IF EXISTS question_tag_delete_touch_trigger ON question_tag;
+CREATE TRIGGER question_tag_delete_touch_trigger AFTER DELETE ON question_tag
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION question_tag_touch_question();
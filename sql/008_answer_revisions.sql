@@ -0,0 +1,41 @@
+-- answer.revision changes whenever the rendered answer block (the answer and its comments) changes;
+-- it keys the fragment cache of question.html
+ALTER TABLE answer ADD COLUMN IF NOT EXISTS revision INTEGER NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION answer_revision_bump() RETURNS trigger AS $$
+BEGIN
+    NEW.revision := OLD.revision + 1;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS answer_revision_trigger ON answer;
+CREATE TRIGGER answer_revision_trigger
+    BEFORE UPDATE ON answer
+    FOR EACH ROW
+    WHEN ((OLD.submission_time, OLD.message, OLD.image, OLD.vote_number)
+          IS DISTINCT FROM (NEW.submission_time, NEW.message, NEW.image, NEW.vote_number))
+    EXECUTE FUNCTION answer_revision_bump();
+
+CREATE OR REPLACE FUNCTION comment_touch_answer() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE answer SET revision = revision + 1
+        WHERE id IN (SELECT answer_id FROM old_rows);
+    ELSE
+        UPDATE answer SET revision = revision + 1
+        WHERE id IN (SELECT answer_id FROM new_rows);
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS comment_insert_answer_trigger ON comment;
+CREATE TRIGGER comment_insert_answer_trigger AFTER INSERT ON comment
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION comment_touch_answer();
+DROP TRIGGER IF EXISTS comment_update_answer_trigger ON comment;
+CREATE TRIGGER comment_update_answer_trigger AFTER UPDATE ON comment
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION comment_touch_answer();
+DROP TRIGGER IF EXISTS comment_delete_answer_trigger ON comment;
+CREATE TRIGGER comment_delete_answer_trigger AFTER DELETE ON comment
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION comment_touch_answer();
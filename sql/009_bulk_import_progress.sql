@@ -0,0 +1,8 @@
+-- rows already loaded per import source and table, written in the same transaction as each batch,
+-- so an interrupted bulk import resumes exactly where it stopped
+CREATE TABLE IF NOT EXISTS bulk_import_progress (
+    source TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    rows_done BIGINT NOT NULL DEFAULT 0,
+    PRIMARY KEY (source, table_name)
+);
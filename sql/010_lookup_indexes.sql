@@ -0,0 +1,6 @@
+-- foreign keys and lookups data_manager filters on; Postgres does not index the referencing side by itself
+-- (question.submission_time, question_tag.question_id and tag.name are covered by 001, the primary key and 005)
+CREATE INDEX IF NOT EXISTS answer_question_id_idx ON answer (question_id);
+CREATE INDEX IF NOT EXISTS comment_question_id_idx ON comment (question_id) WHERE question_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS comment_answer_id_idx ON comment (answer_id) WHERE answer_id IS NOT NULL;
+CREATE INDEX IF NOT EXISTS users_email_idx ON users (email);
@@ -0,0 +1,129 @@
+-- per-question answer and comment counts and the time of the latest post, kept up to date by triggers
+-- so /list can show them and page through "most answered" / "recently active" from an index
+-- comment_count covers the comments on the question and on all of its answers
+ALTER TABLE question ADD COLUMN IF NOT EXISTS answer_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE question ADD COLUMN IF NOT EXISTS comment_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE question ADD COLUMN IF NOT EXISTS last_activity_at TIMESTAMP WITHOUT TIME ZONE;
+
+-- recomputes the three columns from scratch and returns how many rows were off;
+-- used after deletions and by `manage.py repair`
+-- repaired rows get a new revision and last_modified like any other change, so the ETags and the
+-- versioned page caches of every worker move on too (question_revision_trigger does not watch these columns)
+CREATE OR REPLACE FUNCTION refresh_question_activity(question_ids INTEGER[]) RETURNS integer AS $$
+    WITH repaired AS (
+        UPDATE question
+        SET answer_count = activity.answer_count,
+            comment_count = activity.comment_count,
+            last_activity_at = activity.last_activity_at,
+            revision = question.revision + 1,
+            last_modified = now()
+        FROM (
+            SELECT question.id,
+                   (SELECT COUNT(*) FROM answer WHERE answer.question_id = question.id) AS answer_count,
+                   (SELECT COUNT(*) FROM comment WHERE comment.question_id = question.id)
+                       + (SELECT COUNT(*) FROM comment JOIN answer ON answer.id = comment.answer_id
+                          WHERE answer.question_id = question.id) AS comment_count,
+                   GREATEST(question.submission_time,
+                            (SELECT MAX(submission_time) FROM answer WHERE answer.question_id = question.id),
+                            (SELECT MAX(submission_time) FROM comment WHERE comment.question_id = question.id),
+                            (SELECT MAX(comment.submission_time) FROM comment JOIN answer ON answer.id = comment.answer_id
+                             WHERE answer.question_id = question.id)) AS last_activity_at
+            FROM question
+            WHERE question.id = ANY(question_ids)
+        ) AS activity
+        WHERE question.id = activity.id
+          AND (question.answer_count, question.comment_count, question.last_activity_at)
+              IS DISTINCT FROM (activity.answer_count, activity.comment_count, activity.last_activity_at)
+        RETURNING 1
+    )
+    SELECT COUNT(*)::integer FROM repaired;
+$$ LANGUAGE sql;
+
+SELECT refresh_question_activity(ARRAY(SELECT id FROM question WHERE last_activity_at IS NULL));
+
+CREATE INDEX IF NOT EXISTS question_answer_count_id_idx ON question (answer_count, id);
+CREATE INDEX IF NOT EXISTS question_last_activity_at_id_idx ON question (last_activity_at, id);
+
+CREATE OR REPLACE FUNCTION question_activity_start() RETURNS trigger AS $$
+BEGIN
+    NEW.last_activity_at := GREATEST(NEW.last_activity_at, NEW.submission_time);
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS question_activity_start_trigger ON question;
+CREATE TRIGGER question_activity_start_trigger
+    BEFORE INSERT ON question
+    FOR EACH ROW EXECUTE FUNCTION question_activity_start();
+
+-- inserts only ever add to the counts, so they are applied as deltas without reading the other rows
+CREATE OR REPLACE FUNCTION answer_activity_insert() RETURNS trigger AS $$
+BEGIN
+    UPDATE question
+    SET answer_count = question.answer_count + added.count,
+        last_activity_at = GREATEST(question.last_activity_at, added.latest)
+    FROM (SELECT question_id, COUNT(*) AS count, MAX(submission_time) AS latest
+          FROM new_rows GROUP BY question_id) AS added
+    WHERE question.id = added.question_id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+-- an edited answer gets a new submission_time, which counts as activity
+CREATE OR REPLACE FUNCTION answer_activity_update() RETURNS trigger AS $$
+BEGIN
+    UPDATE question
+    SET last_activity_at = GREATEST(question.last_activity_at, edited.latest)
+    FROM (SELECT question_id, MAX(submission_time) AS latest FROM new_rows GROUP BY question_id) AS edited
+    WHERE question.id = edited.question_id
+      AND edited.latest > COALESCE(question.last_activity_at, '-infinity');
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION answer_activity_delete() RETURNS trigger AS $$
+BEGIN
+    PERFORM refresh_question_activity(ARRAY(SELECT DISTINCT question_id FROM old_rows));
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION comment_activity_insert() RETURNS trigger AS $$
+BEGIN
+    UPDATE question
+    SET comment_count = question.comment_count + added.count,
+        last_activity_at = GREATEST(question.last_activity_at, added.latest)
+    FROM (SELECT COALESCE(new_rows.question_id, answer.question_id) AS question_id,
+                 COUNT(*) AS count, MAX(new_rows.submission_time) AS latest
+          FROM new_rows LEFT JOIN answer ON answer.id = new_rows.answer_id
+          GROUP BY 1) AS added
+    WHERE question.id = added.question_id;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION comment_activity_delete() RETURNS trigger AS $$
+BEGIN
+    PERFORM refresh_question_activity(ARRAY(
+        SELECT DISTINCT COALESCE(old_rows.question_id, answer.question_id)
+        FROM old_rows LEFT JOIN answer ON answer.id = old_rows.answer_id));
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS answer_activity_insert_trigger ON answer;
+CREATE TRIGGER answer_activity_insert_trigger AFTER INSERT ON answer
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION answer_activity_insert();
+DROP TRIGGER IF EXISTS answer_activity_update_trigger ON answer;
+CREATE TRIGGER answer_activity_update_trigger AFTER UPDATE ON answer
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION answer_activity_update();
+DROP TRIGGER IF EXISTS answer_activity_delete_trigger ON answer;
+CREATE TRIGGER answer_activity_delete_trigger AFTER DELETE ON answer
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION answer_activity_delete();
+
+DROP TRIGGER IF EXISTS comment_activity_insert_trigger ON comment;
+CREATE TRIGGER comment_activity_insert_trigger AFTER INSERT ON comment
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION comment_activity_insert();
+DROP TRIGGER IF EXISTS comment_activity_delete_trigger ON comment;
+CREATE TRIGGER comment_activity_delete_trigger AFTER DELETE ON comment
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION comment_activity_delete();
@@ -0,0 +1,34 @@
+import threading
+import time
+
+
+# name <-> id map of every tag, loaded once and kept up to date as tags are created
+class TagDictionary:
+    def __init__(self, max_age):
+        self.max_age = max_age
+        self._ids_by_name = {}
+        self._names_by_id = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def is_stale(self):
+        # other workers create tags too, so the whole table is reloaded now and then
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.max_age
+
+    def load(self, tags):
+        with self._lock:
+            self._ids_by_name = {tag['name']: tag['id'] for tag in tags}
+            self._names_by_id = {tag['id']: tag['name'] for tag in tags}
+            self._loaded_at = time.monotonic()
+
+    def add(self, tag_id, name):
+        with self._lock:
+            self._ids_by_name[name] = tag_id
+            self._names_by_id[tag_id] = name
+
+    def get_id(self, name):
+        return self._ids_by_name.get(name)
+
+    def all(self):
+        with self._lock:
+            return [{'id': tag_id, 'name': name} for tag_id, name in sorted(self._names_by_id.items())]
@@ -1,18 +1,50 @@
+import html
+import re
 from datetime import datetime
 
+# ts_headline delimits matched words with these; neither can occur in a message's HTML and html.escape keeps both
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+# a "-term" or -"phrase" of a websearch_to_tsquery phrase, preceded by whitespace or at the start
+_EXCLUDED_TERM = re.compile(r'(?:^|(?<=\s))-("[^"]*"?|\S*)')
+
 
 def get_current_timestamp():
     current_time = datetime.now()
     return current_time.strftime('%Y-%m-%d %H:%M:%S')
 
 
-def underline_phrase(list_of_dics, phrase):
-    for dict in list_of_dics:
-        for key in dict:
-            if type(dict[key]) is str:
-                if phrase in dict[key]:
-                    dict.update({key: dict[key].replace(phrase, f"<mark class='search'>{phrase}</mark>")})
-    return list_of_dics
+def highlight_phrase(search_phrase):
+    # ts_headline marks every word of its query, excluded ones too, so the highlighting query leaves them out
+    return _EXCLUDED_TERM.sub(' ', search_phrase)
+
+
+def highlight_headline(headline, text):
+    if headline is None:
+        return ''
+    plain = headline.replace(HIGHLIGHT_START, '').replace(HIGHLIGHT_STOP, '').strip()
+    snippet = (html.escape(headline.strip())
+               .replace(HIGHLIGHT_START, "<mark class='search'>")
+               .replace(HIGHLIGHT_STOP, '</mark>'))
+    # a headline is an excerpt of the text; mark where it was cut
+    if not text.lstrip().startswith(plain):
+        snippet = '&hellip;' + snippet
+    if not text.rstrip().endswith(plain):
+        snippet += '&hellip;'
+    return snippet
+
+
+def highlight_results(results, fields=('title', 'message')):
+    # the headlines come with the results, see data_manager.SEARCH_QUERY
+    highlighted = []
+    for result in results:
+        row = {'id': result['id'], 'matched_in_answer': result.get('matched_in_answer', False)}
+        for field in fields:
+            row[field] = highlight_headline(result[f'{field}_headline'], result[field])
+        row['answers'] = [{'id': answer['id'], 'message': highlight_headline(answer['headline'], answer['message'])}
+                          for answer in result.get('answers', [])]
+        highlighted.append(row)
+    return highlighted
 
 
 def format_submission_time(epoch_time):
@@ -20,7 +52,3 @@ def format_submission_time(epoch_time):
     return formatted_time
 
 
-# list_of_dics = [{'text1': 'Hello World!'}, {'text2': 'Hello Ood!'}, {'text3': 'Hello Gold'}]
-# phrase = 'Hello'
-#
-# print(underline_phrase(list_of_dics, phrase))
@@ -0,0 +1,69 @@
+import hashlib
+
+import data_manager as dm
+import util
+
+# request handling shared by server.py and async_server.py; the two only differ in how they do the I/O around it
+
+
+def page_validators(version, request, user):
+    # the page also depends on its query string and on who is logged in
+    etag = hashlib.sha1(repr((version['revision'], version['last_modified'], request.full_path,
+                              user)).encode()).hexdigest()
+    last_modified = version['last_modified'].replace(microsecond=0) if version['last_modified'] else None
+    return etag, last_modified
+
+
+def not_modified(request, etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    return (last_modified is not None and request.if_modified_since is not None
+            and last_modified <= request.if_modified_since)
+
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+def sort_order(args):
+    order_by = args.get('order_by', 'submission_time')
+    order_direction = args.get('order_direction', 'desc')
+    if order_by not in dm.QUESTION_SORT_KEYS:
+        order_by = 'submission_time'
+    if order_direction not in ('asc', 'desc'):
+        order_direction = 'desc'
+    return order_by, order_direction
+
+
+def page_cursor(args):
+    # a mangled cursor shows the first page rather than an error
+    page_cursor = args.get('cursor')
+    if page_cursor is None:
+        return None
+    try:
+        dm.decode_page_cursor(page_cursor)
+    except ValueError:
+        return None
+    return page_cursor
+
+
+def search_page(args):
+    return max(args.get('page', 1, type=int), 1)
+
+
+def search_listing(search):
+    results = util.highlight_results(search['results']) if search is not None else None
+    return results or 'No results'
+
+
+def selected_tags(form):
+    # several new tags can be given at once, separated by commas
+    selected = form.getlist('tag')
+    tag_ids = [tag_id for tag_id in selected if tag_id and tag_id != 'add_new_tag']
+    new_tags = form.get('new_tag', '').split(',') if 'add_new_tag' in selected else []
+    return tag_ids, new_tags